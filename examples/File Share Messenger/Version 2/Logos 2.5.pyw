@@ -17,6 +17,9 @@ import traceback
 import sys
 import contextlib
 import io
+import time
+import functools
+import collections
 
 ################################################################################
 
@@ -173,11 +176,39 @@ class Color:
 
     @property
     def best_name(self):
-        diffs = []
-        for name in self.HTML.keys():
-            diffs.append((name, self.diff(getattr(self, name))))
-        error = min(diffs, key=lambda pair: pair[1])[1]
-        return tuple(pair[0] for pair in diffs if pair[1] == error)
+        return self.__nearest(*self.__rgb)
+
+    # Named colors are indexed by a cube of 32 x 32 x 32 cells.
+    CELL = 8
+
+    @classmethod
+    @functools.lru_cache(1 << 10)
+    def __nearest(cls, red, green, blue):
+        best, names = None, []
+        for name, r, g, b in cls.__cell(red // cls.CELL,
+                                        green // cls.CELL,
+                                        blue // cls.CELL):
+            error = (red - r) ** 2 + (green - g) ** 2 + (blue - b) ** 2
+            if best is None or error < best:
+                best, names = error, [name]
+            elif error == best:
+                names.append(name)
+        return tuple(names)
+
+    @classmethod
+    @functools.lru_cache(None)
+    def __cell(cls, x, y, z):
+        # Only names that could beat the farthest corner of the best are kept.
+        low, candidates, limit = (x, y, z), [], None
+        for entry in cls.PALETTE:
+            near = far = 0
+            for point, index in zip(entry[1:], low):
+                start, end = index * cls.CELL, index * cls.CELL + cls.CELL - 1
+                near += max(start - point, 0, point - end) ** 2
+                far += max(point - start, end - point) ** 2
+            candidates.append((near, entry))
+            limit = far if limit is None else min(limit, far)
+        return tuple(entry for near, entry in candidates if near <= limit)
 
     ########################################################################
 
@@ -331,6 +362,8 @@ class Color:
 
 for key, value in Color.HTML.items():
     setattr(Color, key, Color.parse(value))
+Color.PALETTE = tuple((name,) + tuple(bytes.fromhex(value[1:]))
+                      for name, value in Color.HTML.items())
 
 ################################################################################
 
@@ -1090,7 +1123,8 @@ class Settings:
                'link_foreground': Color.Blue,
                'link_underline': True,
                'message_cutoff': 24,
-               'message_confuser': False}
+               'message_confuser': False,
+               'message_lines': 5000}
     
     def __init__(self, path):
         # Save the path and load settings from file.
@@ -1159,27 +1193,43 @@ uuid = lambda: ''.join(random(string, len(string)))
 
 class DirectoryMonitor:
 
+    MIN_INTERVAL = 250      # Milliseconds between scans after activity.
+    MAX_INTERVAL = 8000     # Milliseconds between scans when idle.
+
     def __init__(self, path):
         # Save directory path and file monitors (by path).
         self.__path = path
         self.__files = {}
+        self.__delay = self.MIN_INTERVAL
+
+    @property
+    def interval(self):
+        # Milliseconds to wait before the next scan.
+        return self.__delay
 
-    def update(self, callback):
+    def update(self, callback, force=False):
         # Discover any files are new to the path.
         for name in os.listdir(self.__path):
             if self.valid_name(name) and name not in self.__files:
                 path_name = os.path.join(self.__path, name)
                 self.__files[name] = FileMonitor(path_name)
         errors = set()
-        # Try updating each file monitor with reference to callback.
-        for name, monitor in self.__files.items():
+        active = False
+        # Try updating each file monitor (most recently active first).
+        for name, monitor in sorted(self.__files.items(), reverse=True,
+                                    key=lambda item: item[1].active):
             try:
-                monitor.update(callback)
+                active |= monitor.update(callback, force)
             except OSError:
                 errors.add(name)
         # Remove any problem files from the list.
         for name in errors:
             del self.__files[name]
+        # Poll quickly after activity and back off exponentially when idle.
+        if active:
+            self.__delay = self.MIN_INTERVAL
+        else:
+            self.__delay = min(self.__delay * 2, self.MAX_INTERVAL)
 
     @staticmethod
     def valid_name(name):
@@ -1196,16 +1246,32 @@ class DirectoryMonitor:
 
 class FileMonitor:
 
+    MIN_DELAY = DirectoryMonitor.MIN_INTERVAL / 1000    # Hot streams
+    MAX_DELAY = DirectoryMonitor.MAX_INTERVAL / 1000    # Cold streams
+
     def __init__(self, path):
         # Track mondification is a file and present position within file.
         self.__path = path
         self.__modified = 0
         self.__position = 0
+        # Remember when the file changed and when it should be checked.
+        self.__delay = self.MIN_DELAY
+        self.__due = self.__active = 0
 
-    def update(self, callback):
+    @property
+    def active(self):
+        # Give the monotonic time when the file last had new data.
+        return self.__active
+
+    def update(self, callback, force=False):
+        # Cold files are not checked until they are due (unless forced).
+        now = time.monotonic()
+        if not force and now < self.__due:
+            return False
         # Find out if the file has been modified.
         modified = os.path.getmtime(self.__path)
-        if modified != self.__modified:
+        changed = modified != self.__modified
+        if changed:
             # Remember the present time (we are getting an update).
             self.__modified = modified
             with open(self.__path, 'r') as file:
@@ -1220,6 +1286,13 @@ class FileMonitor:
                 self.__position = file.tell()
             # Execute callback with file ID and new text update.
             callback(self.__path, text)
+            self.__active = now
+            self.__delay = self.MIN_DELAY
+        else:
+            # Wait twice as long before looking at an idle file again.
+            self.__delay = min(self.__delay * 2, self.MAX_DELAY)
+        self.__due = now + self.__delay
+        return changed
 
 ################################################################################
 
@@ -1414,7 +1487,7 @@ class Logos(tkinter.ttk.Frame):
         self.__monitor = DirectoryMonitor(log_path)
         self.__messages = Aggregator()
         # Start looking for updates to the files.
-        self.after_idle(self.update)
+        self.__timer = self.after_idle(self.update)
 
     def configure_widgets(self):
         # Create widgets.
@@ -1457,6 +1530,9 @@ class Logos(tkinter.ttk.Frame):
         self.__first_line = True
         self.__url_id = 0
         self.__path_id = 0
+        # Text is inserted in batches and old links are forgotten in order.
+        self.__segments = []
+        self.__links = collections.deque()
 
     def select_all(self, event):
         # Select everything in the widget.
@@ -1468,17 +1544,46 @@ class Logos(tkinter.ttk.Frame):
         text = self.__entry.get()
         self.__entry.delete(0, tkinter.END)
         self.__writer.write(text)
+        # Show the message now instead of waiting for the next update.
+        self.after_cancel(self.__timer)
+        self.update(True)
 
-    def update(self):
-        # Update the directory monitor once a second.
-        self.after(1000, self.update)
-        self.__monitor.update(self.__messages.update)
+    def update(self, force=False):
+        # Update the directory monitor (sooner when there is activity).
+        try:
+            self.__monitor.update(self.__messages.update, force)
+        finally:
+            self.__timer = self.after(self.__monitor.interval, self.update)
         # For each message, show those less than a day old.
         utcnow = datetime.datetime.utcnow()
         for message in self.__messages.get_messages():
             hours = (utcnow - message.time).total_seconds() / 3600
             if hours < SETTINGS.message_cutoff and self.allowed(message):
                 self.display(message)
+        self.render()
+
+    def render(self):
+        # Insert all of the queued text at once and scroll to the bottom.
+        if self.__segments:
+            self.__text['state'] = tkinter.NORMAL
+            self.__text.insert(tkinter.END, *self.__segments)
+            self.__segments.clear()
+            self.trim(SETTINGS.message_lines)
+            self.__text.see(tkinter.END)
+            self.__text['state'] = tkinter.DISABLED
+
+    def trim(self, limit):
+        # Remove lines from the top so that no more than limit remain.
+        lines = int(self.__text.index('end-1c').split('.')[0])
+        if 0 < limit < lines:
+            self.__text.delete('1.0', '{}.0'.format(lines - limit + 1))
+            # Forget the links whose text has been removed.
+            while self.__links and not self.__text.tag_ranges(self.__links[0]):
+                self.__text.tag_delete(self.__links.popleft())
+
+    def append_text(self, string, *tag):
+        # Queue the text for the bottom of the widget with the given tags.
+        self.__segments.extend((string, tag))
 
     def allowed(self, message):
         # If there is no text, it is not allowed.
@@ -1535,25 +1640,22 @@ class Logos(tkinter.ttk.Frame):
         return None, message, False
 
     def display(self, message):
-        # Enable changes and take first line into account.
-        self.__text['state'] = tkinter.NORMAL
+        # Take the first line into account.
         if self.__first_line:
             self.__first_line = False
         else:
-            self.__text.insert(tkinter.END, '\n')
+            self.append_text('\n')
         # Show the timestamp if requested.
         if SETTINGS.show_timestamp:
             diff = datetime.datetime.now() - datetime.datetime.utcnow()
             time = message.time + diff
             # Display string that has been corrected for local time zone.
-            self.__text.insert(tkinter.END, time.strftime('%I:%M %p'), 'time')
-            self.__text.insert(tkinter.END, ' ')
+            self.append_text(time.strftime('%I:%M %p'), 'time')
+            self.append_text(' ')
         # Show the name with the proper color (message.tag).
-        self.__text.insert(tkinter.END, '[' + message.name + ']', message.tag)
-        # Add text with formatting, scroll to botton, and disable changes.
+        self.append_text('[' + message.name + ']', message.tag)
+        # Add text with formatting (it is shown when rendered).
         self.add_text_with_URLs(' ' + message.text)
-        self.__text.see(tkinter.END)
-        self.__text['state'] = tkinter.DISABLED
 
     def add_text_with_URLs(self, message):
         url_list = self.find_urls(message)
@@ -1580,8 +1682,9 @@ class Logos(tkinter.ttk.Frame):
         self.__url_id += 1
         tag = 'url' + str(self.__url_id)
         # Insert the text and bind a command to open a webbrowser.
-        self.__text.insert(tkinter.END, url, ('dynamic_link', tag))
+        self.append_text(url, 'dynamic_link', tag)
         self.__text.tag_bind(tag, '<1>', lambda event: webbrowser.open(url))
+        self.__links.append(tag)
 
     def create_path(self, path, name):
         # If the user is running Windows ...
@@ -1590,17 +1693,18 @@ class Logos(tkinter.ttk.Frame):
             self.__path_id += 1
             tag = 'path' + str(self.__path_id)
             # Add the text and create an opening command.
-            self.__text.insert(tkinter.END, name, ('dynamic_link', tag))
+            self.append_text(name, 'dynamic_link', tag)
             self.__text.tag_bind(tag, '<1>', lambda event: os.startfile(path))
+            self.__links.append(tag)
         else:
             # Insert a link that does not do anything.
-            self.__text.insert(tkinter.END, name, 'static_link')
+            self.append_text(name, 'static_link')
 
     def add_plain_text(self, message):
         # Confuse text if needed before adding text to display.
         if SETTINGS.message_confuser:
             message = confuse(message)
-        self.__text.insert(tkinter.END, message)
+        self.append_text(message)
 
     def find_paths(self, message):
         # Track found paths and current search positions.
@@ -1,4 +1,4 @@
-# <source name="χερμενεύς 1.1.py" size="1bfcf" hash="8171dd927465c64ab8996403fcec724c2d32e126cb4793a1a31b408e05840d5e8768917a8dfd3a81fcec0311b0521870d48e80a2c8037777165079f871193d65" />
+# <source name="χερμενεύς 1.1.py" size="2551b" hash="7cc206c3d20fa9a8be0fcb2cf34969fb78320489cd0fdc69abe9acecfe05e1ca6953fe1d5d633798440d6e9ad07ff1122e98e65663162d539e4d27ae91ab35ab" />
 """Module for running a specialized File Share Messenger program.
 
 The code in this file is designed to provide all of the needed abilities
@@ -17,14 +17,12 @@ import os
 import string
 import random
 import colorsys
-import urllib.parse
 import webbrowser
 import pickle
 import traceback
 import sys
 import contextlib
 import io
-import hashlib
 import threading
 import _thread
 import queue
@@ -33,6 +31,14 @@ import operator
 import pydoc
 import imp
 import re
+import ctypes.util
+import struct
+import hashlib
+import collections
+import heapq
+import math
+import concurrent.futures
+import functools
 # Module contents can be imported.
 from uuid import uuid4
                 
@@ -52,7 +58,8 @@ def main():
         tkinter.NoDefaultRoot()
         root = Tk()
         # Proceed start up the rest of the systems.
-##        sentinel = Blinx(root, '..')
+##        sentinel = Blinx(root, '..', os.path.join(private_path, 'Pickles',
+##                                                  'blinx.pickle'))
 ##        sentinel.start()
         HermeneusCommands.main(root, public_path, private_path)
 ##        sentinel.join()
@@ -92,23 +99,104 @@ class AffinityLoop:
 
     Restricts code execution to thread that instance was created on."""
 
-    __slots__ = '__action', '__thread'
+    __slots__ = ('__action', '__thread', '__local',
+                 '__wake', '__pipe', '__quit')
 
     def __init__(self):
         "Initializes AffinityLoop with job queue and thread identity."
         self.__action = queue.Queue()
         self.__thread = _thread.get_ident()
+        self.__local = threading.local()
+        # New jobs set the event and write to the pipe (if there is one).
+        self.__wake = threading.Event()
+        self.__pipe = None
+        self.__quit = False
 
     def run(self, func, *args, **keywords):
         "Runs function on creating thread and returns result."
         if _thread.get_ident() == self.__thread:
             self.__run_jobs()
             return func(*args, **keywords)
+        calls = getattr(self.__local, 'calls', None)
+        if calls is not None:
+            # Batched calls are sent together when the batch is over.
+            calls.append((func, args, keywords))
         else:
             job = self.__Job(func, args, keywords)
             self.__action.put_nowait(job)
+            self.__signal()
             return job.result
 
+    def __signal(self):
+        "Wakes up the creating thread so that it can run the new job."
+        self.__wake.set()
+        if self.__pipe is not None:
+            try:
+                os.write(self.__pipe[1], b'\0')
+            except BlockingIOError:
+                pass    # The pipe is full, so a wake up is already due.
+
+    def wait(self, timeout):
+        "Sleeps until a job arrives or timeout passes; False means quit."
+        self.__wake.wait(timeout)
+        self.__wake.clear()
+        running, self.__quit = not self.__quit, False
+        return running
+
+    def quit(self):
+        "Wakes the creating thread and has its next wait return False."
+        self.__quit = True
+        self.__signal()
+
+    def restart(self):
+        "Forgets any quit requested before a new loop started waiting."
+        self.__quit = False
+
+    def fileno(self):
+        "Returns a descriptor that becomes readable when jobs arrive."
+        if self.__pipe is None:
+            pipe = os.pipe()
+            for descriptor in pipe:
+                os.set_blocking(descriptor, False)
+            self.__pipe = pipe
+        return self.__pipe[0]
+
+    def drain(self, file=None, mask=None):
+        "Empties the pipe and runs the jobs (a Tk file handler)."
+        try:
+            while os.read(self.__pipe[0], 1 << 12):
+                pass
+        except BlockingIOError:
+            pass
+        self.__run_jobs()
+
+    def claim(self):
+        "Runs pending jobs and returns True if called on creating thread."
+        if _thread.get_ident() == self.__thread:
+            self.__run_jobs()
+            return True
+        return False
+
+    @contextlib.contextmanager
+    def batch(self):
+        "Groups calls from other threads into one job (results are lost)."
+        if self.claim() or getattr(self.__local, 'calls', None) is not None:
+            yield
+        else:
+            self.__local.calls = calls = []
+            try:
+                yield
+            finally:
+                self.__local.calls = None
+            if calls:
+                self.run(self.__run_calls, calls)
+
+    @staticmethod
+    def __run_calls(calls):
+        "Runs the calls from a batch in the order that they were made."
+        for func, args, keywords in calls:
+            func(*args, **keywords)
+
     def __run_jobs(self):
         "Runs all pending jobs currently in the job queue."
         while not self.__action.empty():
@@ -196,8 +284,10 @@ class _ThreadSafe:
     @classmethod
     def __run(cls, func, *args, **keywords):
         "Executes the function after converting the arguments."
-        args = tuple(cls.unwrap(i) for i in args)
-        keywords = dict((k, cls.unwrap(v)) for k, v in keywords.items())
+        if any(isinstance(i, _ThreadSafe) for i in args):
+            args = tuple(cls.unwrap(i) for i in args)
+        if any(isinstance(v, _ThreadSafe) for v in keywords.values()):
+            keywords = dict((k, cls.unwrap(v)) for k, v in keywords.items())
         return func(*args, **keywords)
 
     @staticmethod
@@ -227,9 +317,12 @@ class _ThreadSafe:
         setattr(self, name, attr)
         return attr
 
-    def __callback(self, path, *args, **keywords):
+    def __callback(self, attr, args, keywords):
         "Schedules execution of named method from attribute proxy."
-        return self.__schedule(self.__method, path, *args, **keywords)
+        if self.__job.claim():
+            # The GUI thread calls the (cached) method directly.
+            return self.__run(attr.resolve(self.__obj), *args, **keywords)
+        return self.__schedule(self.__method, attr.path, *args, **keywords)
 
     def __method(self, path, *args, **keywords):
         "Extracts a method and runs it with the provided arguments."
@@ -246,16 +339,40 @@ class _ThreadSafe:
         "Schedules for the destruction of this widget."
         return self.__schedule(self.__obj.destroy)
 
+    def batch(self):
+        "Returns a context that sends a thread's calls as a single job."
+        return self.__job.batch()
+
     def mainloop(self):
         "Processes all GUI events according to tkinter's settings."
-        target = time.clock()
-        while True:
-            try:
-                self.update()
-            except tkinter.TclError:
-                break
-            target += tkinter._tkinter.getbusywaitinterval() / 1000
-            time.sleep(max(target - time.clock(), 0))
+        if hasattr(self.__obj.tk, 'createfilehandler'):
+            # Tk sleeps until timers or files are due; jobs come by pipe.
+            self.__schedule(self.__listen)
+            self.__schedule(self.__obj.mainloop)
+        else:
+            interval = tkinter._tkinter.getbusywaitinterval() / 1000
+            self.__job.restart()
+            while True:
+                try:
+                    self.update()
+                except tkinter.TclError:
+                    break
+                # Sleep until a job arrives or Tk needs to be polled again.
+                if not self.__job.wait(interval):
+                    break
+
+    def quit(self):
+        "Ends the mainloop whether Tk or the polling loop is running it."
+        result = self.__schedule(self.__obj.quit)
+        self.__job.quit()
+        return result
+
+    def __listen(self):
+        "Has Tk run cross-thread jobs as soon as they are signalled."
+        self.__obj.tk.createfilehandler(self.__job.fileno(), tkinter.READABLE,
+                                        self.__job.drain)
+        # Jobs queued before the pipe existed only set the event, so run them.
+        self.__job.drain()
     
     ########################################################################
 
@@ -265,16 +382,30 @@ class _ThreadSafe:
 
         Saves an attribute's name and wait for execution."""
 
-        __slots__ = '__callback', '__path'
+        __slots__ = '__callback', '__path', '__method'
 
         def __init__(self, callback, path):
             "Initializes proxy with callback and method path."
             self.__callback = callback
             self.__path = path
+            self.__method = None
 
         def __call__(self, *args, **keywords):
             "Runs a known method with the given arguments."
-            return self.__callback(self.__path, *args, **keywords)
+            return self.__callback(self, args, keywords)
+
+        @property
+        def path(self):
+            "Returns the names that lead to the method."
+            return self.__path
+
+        def resolve(self, obj):
+            "Finds the method on the object and caches it for later."
+            if self.__method is None:
+                for name in self.__path:
+                    obj = getattr(obj, name)
+                self.__method = obj
+            return self.__method
 
         def __getattr__(self, name):
             "Generates a proxy object for a sub-attribute."
@@ -472,11 +603,41 @@ class Color:
     @property
     def best_name(self):
         "Returns the closest color names for the current color."
-        diffs = []
-        for name in self.HTML.keys():
-            diffs.append((name, self.diff(getattr(self, name))))
-        error = min(diffs, key=lambda pair: pair[1])[1]
-        return tuple(pair[0] for pair in diffs if pair[1] == error)
+        return self.__nearest(*self.__rgb)
+
+    # Named colors are indexed by a cube of 32 x 32 x 32 cells.
+    CELL = 8
+
+    @classmethod
+    @functools.lru_cache(1 << 10)
+    def __nearest(cls, red, green, blue):
+        "Private class method: finds the names closest to a color."
+        best, names = None, []
+        for name, r, g, b in cls.__cell(red // cls.CELL,
+                                        green // cls.CELL,
+                                        blue // cls.CELL):
+            error = (red - r) ** 2 + (green - g) ** 2 + (blue - b) ** 2
+            if best is None or error < best:
+                best, names = error, [name]
+            elif error == best:
+                names.append(name)
+        return tuple(names)
+
+    @classmethod
+    @functools.lru_cache(None)
+    def __cell(cls, x, y, z):
+        "Private class method: lists names that may be closest in a cell."
+        # Only names that could beat the farthest corner of the best are kept.
+        low, candidates, limit = (x, y, z), [], None
+        for entry in cls.PALETTE:
+            near = far = 0
+            for point, index in zip(entry[1:], low):
+                start, end = index * cls.CELL, index * cls.CELL + cls.CELL - 1
+                near += max(start - point, 0, point - end) ** 2
+                far += max(point - start, end - point) ** 2
+            candidates.append((near, entry))
+            limit = far if limit is None else min(limit, far)
+        return tuple(entry for near, entry in candidates if near <= limit)
 
     ########################################################################
 
@@ -665,6 +826,8 @@ class Color:
 for key, value in Color.HTML.items():
     setattr(Color, key, Color.parse(value))
 del key, value
+Color.PALETTE = tuple((name,) + tuple(bytes.fromhex(value[1:]))
+                      for name, value in Color.HTML.items())
 
 ################################################################################
 
@@ -1726,8 +1889,15 @@ class Settings:
                'link_underline': True,
                'message_cutoff': 24,
                'message_confuser': False,
-               'command_foreground': Color.FireBrick}
-    APP_DAT = {'out_msg_file': ''}
+               'command_foreground': Color.FireBrick,
+               'message_backfill': 1000,
+               'message_lines': 5000,
+               'write_delay': 250,
+               'write_sync': False,
+               'stream_version': 1}
+    APP_DAT = {'out_msg_file': '',
+               'out_msg_hash': None,
+               'stream_offsets': {}}
     
     def __init__(self, path, file, default):
         "Initializes settings instance with its data store."
@@ -1769,10 +1939,11 @@ class Settings:
             os.makedirs(self.__path)
         elif os.path.isfile(self.__path):
             raise IOError('Directory cannot be created!')
-        # Pickle and save the settings in the specified path (filename).
+        # Pickle the settings and replace the file (filename) in one step.
         filename = os.path.join(self.__path, self.__file)
-        with open(filename, 'wb') as file:
+        with open(filename + '.tmp', 'wb') as file:
             pickle.dump(self.__data, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + '.tmp', filename)
 
     def __getattr__(self, name):
         "Gets an attribute."
@@ -1815,33 +1986,85 @@ uuid = UUID()   # Global object for generating UUIDs.
 
 class DirectoryMonitor:
 
-    "DirectoryMonitor(path) -> DirectoryMonitor"
+    "DirectoryMonitor(path, resume=None) -> DirectoryMonitor"
+
+    MIN_INTERVAL = 250          # Milliseconds between scans after activity.
+    MAX_INTERVAL = 8000         # Milliseconds between scans when idle.
+    RESCAN_INTERVAL = 30000     # Milliseconds between scans when notified.
 
-    __slots__ = '__path', '__files'
+    __slots__ = '__path', '__files', '__notifier', '__delay', '__resume'
 
-    def __init__(self, path):
+    def __init__(self, path, resume=None):
         "Initializes instance with path to directory to monitor."
         # Save directory path and file monitors (by path).
         self.__path = path
         self.__files = {}
+        # The resume function tells where reading a new file should start.
+        self.__resume = resume
+        # Try getting change notifications (None means we have to poll).
+        self.__notifier = DirectoryNotifier.open(path)
+        self.__delay = self.MIN_INTERVAL
 
-    def update(self, callback):
+    @property
+    def notifier(self):
+        "Returns the change notifier or None if polling is required."
+        return self.__notifier
+
+    @property
+    def interval(self):
+        "Returns the number of milliseconds to wait between full scans."
+        if self.__notifier is None:
+            return self.__delay
+        return self.RESCAN_INTERVAL
+
+    def update(self, callback, force=False):
         "Looks for changes in the monitored files and updates to callback."
         # Discover any files are new to the path.
         for name in os.listdir(self.__path):
             if self.valid_name(name) and name not in self.__files:
-                path_name = os.path.join(self.__path, name)
-                self.__files[name] = FileMonitor(path_name)
+                self.__watch(name)
         errors = set()
-        # Try updating each file monitor with reference to callback.
-        for name, monitor in self.__files.items():
+        active = False
+        # Try updating each file monitor (most recently active first).
+        for name, monitor in sorted(self.__files.items(), reverse=True,
+                                    key=lambda item: item[1].active):
             try:
-                monitor.update(callback)
+                active |= monitor.update(callback, force)
             except OSError:
                 errors.add(name)
         # Remove any problem files from the list.
         for name in errors:
             del self.__files[name]
+        # Poll quickly after activity and back off exponentially when idle.
+        if active:
+            self.__delay = self.MIN_INTERVAL
+        else:
+            self.__delay = min(self.__delay * 2, self.MAX_INTERVAL)
+
+    def changes(self, callback):
+        "Updates only the files that the notifier reported as changed."
+        names = self.__notifier.read()
+        # The kernel dropped events, so everything must be checked.
+        if names is None:
+            self.update(callback)
+            return
+        for name in filter(self.valid_name, names):
+            if name not in self.__files:
+                self.__watch(name)
+            # Files that were removed or cannot be read are forgotten.
+            try:
+                self.__files[name].update(callback, True)
+            except OSError:
+                del self.__files[name]
+
+    def __watch(self, name):
+        "Creates a file monitor starting where the stream left off."
+        path_name = os.path.join(self.__path, name)
+        if self.__resume is None:
+            self.__files[name] = FileMonitor(path_name)
+        else:
+            position = self.__resume(path_name)
+            self.__files[name] = FileMonitor(path_name, position)
 
     @staticmethod
     def valid_name(name):
@@ -1858,26 +2081,141 @@ class DirectoryMonitor:
 
 ################################################################################
 
+# On Linux, inotify can report directory changes so they need not be polled.
+
+class DirectoryNotifier:
+
+    "DirectoryNotifier(fd) -> DirectoryNotifier"
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+           IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct('iIII')   # wd, mask, cookie, len
+    # Kernels cannot report changes made by other hosts on these filesystems.
+    REMOTE = {'cifs', 'smb3', 'smbfs', 'nfs', 'nfs4', 'ncpfs',
+              'afs', '9p', 'fuse.sshfs', 'davfs', 'fuse.davfs2'}
+
+    __slots__ = '__fd'
+
+    @classmethod
+    def open(cls, path):
+        "Returns a notifier for the path or None if it is not supported."
+        if not sys.platform.startswith('linux') or cls.is_remote(path):
+            return None
+        library = ctypes.util.find_library('c')
+        if library is None:
+            return None
+        try:
+            libc = ctypes.CDLL(library, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(path), cls.MASK) < 0:
+            os.close(fd)
+            return None
+        return cls(fd)
+
+    @classmethod
+    def is_remote(cls, path):
+        "Finds out if the path is on a network share (without notifications)."
+        path = os.path.realpath(path)
+        best, kind = '', ''
+        try:
+            with open('/proc/mounts') as file:
+                for line in file:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+                    # Mount points escape spaces in /proc/mounts.
+                    mount = fields[1].replace('\\040', ' ')
+                    inside = path == mount or \
+                             path.startswith(mount.rstrip('/') + '/')
+                    if inside and len(mount) >= len(best):
+                        best, kind = mount, fields[2]
+        except OSError:
+            return True
+        return kind in cls.REMOTE
+
+    def __init__(self, fd):
+        "Initializes the notifier with an inotify file descriptor."
+        self.__fd = fd
+
+    def __del__(self):
+        "Closes the file descriptor when the notifier is discarded."
+        os.close(self.__fd)
+
+    def fileno(self):
+        "Returns the file descriptor so the notifier can be waited on."
+        return self.__fd
+
+    def read(self):
+        "Returns names of changed files or None if events were lost."
+        names = set()
+        while True:
+            try:
+                data = os.read(self.__fd, 1 << 16)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, size = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                if mask & self.IN_Q_OVERFLOW:
+                    return None
+                name = data[offset:offset+size].rstrip(b'\0')
+                offset += size
+                if name:
+                    names.add(os.fsdecode(name))
+
+################################################################################
+
 # Changes in files can be tracked with the FileMonitor class below.
 
 class FileMonitor:
 
-    "FileMonitor(path) -> FileMonitor"
+    "FileMonitor(path, position=None) -> FileMonitor"
 
-    __slots__ = '__path', '__modified', '__position'
+    MIN_DELAY = DirectoryMonitor.MIN_INTERVAL / 1000    # Hot streams
+    MAX_DELAY = DirectoryMonitor.MAX_INTERVAL / 1000    # Cold streams
 
-    def __init__(self, path):
+    __slots__ = ('__path', '__modified', '__position',
+                 '__delay', '__due', '__active')
+
+    def __init__(self, path, position=None):
         "Initializes instance with path to file for monitoring."
         # Track modification of file and present position within file.
         self.__path = path
         self.__modified = 0
-        self.__position = MessageWriter.SIGNATURE_LENGTH    # Skip the tag.
+        if position is None:
+            position = MessageWriter.SIGNATURE_LENGTH   # Skip the tag.
+        self.__position = position
+        # Remember when the file changed and when it should be checked.
+        self.__delay = self.MIN_DELAY
+        self.__due = self.__active = 0
+
+    @property
+    def active(self):
+        "Returns the monotonic time when the file last had new data."
+        return self.__active
 
-    def update(self, callback):
+    def update(self, callback, force=False):
         "Calls the callback with any updated information in file."
+        # Cold files are not checked until they are due (unless forced).
+        now = time.monotonic()
+        if not force and now < self.__due:
+            return False
         # Find out if the file has been modified.
         modified = os.path.getmtime(self.__path)
-        if modified != self.__modified:
+        changed = modified != self.__modified
+        if changed:
             # Remember the present time (we are getting an update).
             self.__modified = modified
             with open(self.__path, 'rb') as file:
@@ -1887,6 +2225,13 @@ class FileMonitor:
                 self.__position = file.tell()
             # Execute callback with file ID and new text update.
             callback(self.__path, text)
+            self.__active = now
+            self.__delay = self.MIN_DELAY
+        else:
+            # Wait twice as long before looking at an idle file again.
+            self.__delay = min(self.__delay * 2, self.MAX_DELAY)
+        self.__due = now + self.__delay
+        return changed
 
 ################################################################################
 
@@ -1894,37 +2239,71 @@ class FileMonitor:
 
 class Aggregator:
 
-    "Aggregator() -> Aggregator"
+    "Aggregator(checkpoints=None, backfill=None) -> Aggregator"
 
     NULL = b'\0\1\0\1\0'
 
-    __slots__ = '__streams'
+    __slots__ = '__streams', '__checkpoints', '__backfill'
 
-    def __init__(self):
+    def __init__(self, checkpoints=None, backfill=None):
         "Initializes aggregator with a storage area for streams."
         # Keep track of message streams.
         self.__streams = {}
+        # Saved stream states (by filename) and messages to keep per stream.
+        self.__checkpoints = dict(checkpoints or {})
+        self.__backfill = backfill
 
     def update(self, path, text):
         "Posts an update to a stream (path) with data (text)."
         # Create a new MessageStream if the path is not recognized.
         if path not in self.__streams:
-            self.__streams[path] = MessageStream()
-        # Split text on NULL and check that there is nothing following.
-        parts = text.split(self.NULL)
-        if parts[-1]:
-            raise IOError('Text is not properly terminated!')
-        # Update stream with all message parts except the last empty one.
-        self.__streams[path].update(parts[:-1])
+            self.__streams[path] = MessageStream(backfill=self.__backfill)
+        # The stream decodes whichever format the file was written in.
+        self.__streams[path].update(text)
 
     def get_messages(self):
         "Returns all messages waiting for pickup in the aggregator."
-        all_messages = []
         # Get all new messages waiting in the streams.
-        for stream in self.__streams.values():
-            all_messages.extend(stream.get_messages())
-        # Return them sorted by the timestamps.
-        return sorted(all_messages, key=lambda message: message.time)
+        waiting = [stream.get_messages() for stream in self.__streams.values()]
+        # Each stream is in order already, so merge them by their timestamps.
+        return list(heapq.merge(*filter(None, waiting),
+                                key=lambda message: message.time))
+
+    def resume(self, path):
+        "Returns where reading should start for the stream (path)."
+        # Streams that are already known continue where they stopped.
+        if path in self.__streams:
+            return self.__streams[path].position
+        state = self.__checkpoints.pop(os.path.basename(path), None)
+        if state is not None:
+            position, name, offset = state
+            try:
+                with open(path, 'rb') as file:
+                    # The file should still belong to the same person ...
+                    file.seek(MessageWriter.SIGNATURE_LENGTH)
+                    owner = MessageStream.identify(file.read(256))
+                    # ... and should not have been cut short since then.
+                    size = file.seek(0, os.SEEK_END)
+            except OSError:
+                pass
+            else:
+                if owner is not None and owner[1] == name and size >= position:
+                    self.__streams[path] = MessageStream(name, offset,
+                                                         self.__backfill,
+                                                         owner[0])
+                    return offset
+        # Otherwise, the whole file will need to be read.
+        return MessageWriter.SIGNATURE_LENGTH
+
+    def checkpoint(self, hours):
+        "Returns the stream states needed to reload messages hours old."
+        oldest = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+        checkpoints = {}
+        for path, stream in self.__streams.items():
+            state = stream.checkpoint(oldest)
+            if state is not None:
+                checkpoints[os.path.basename(path)] = state
+        return checkpoints
 
 ################################################################################
 
@@ -1932,33 +2311,130 @@ class Aggregator:
 
 class MessageStream:
 
-    "MessageStream() -> MessageStream"
+    "MessageStream(name=None, position=None, backfill=None, version=None)"
 
-    __slots__ = '__name', '__buffer', '__waiting'
+    __slots__ = ('__name', '__buffer', '__waiting',
+                 '__position', '__marks', '__version')
 
-    def __init__(self):
+    def __init__(self, name=None, position=None, backfill=None, version=None):
         "Initializes stream with variables for building text messages."
         # Save name, buffered tail, and any waiting messages.
-        self.__name = None
+        self.__name = name
         self.__buffer = None
         self.__waiting = []
+        # Track the file position and where recent messages started.
+        if position is None:
+            position = MessageWriter.SIGNATURE_LENGTH
+        self.__position = position
+        self.__marks = collections.deque(maxlen=backfill)
+        # The format is found from the first byte unless it is given.
+        self.__version = version
 
-    def update(self, parts):
-        "Takes parts and buffers text messages built from them."
-        parts = [part.decode('utf-16') for part in parts]
-        # If there is no name, assume the first part is the name.
-        if self.__name is None:
-            self.__name = parts.pop(0)
-        # If something is in the buffer, add it to front of parts and clear.
+    @staticmethod
+    def identify(head):
+        "Returns (version, name) from the start of a stream or None."
+        if head.startswith(MessageWriter.MAGIC):
+            # Version 2 streams start with a record holding the name.
+            offset = len(MessageWriter.MAGIC)
+            record = MessageWriter.RECORD
+            if len(head) >= offset + record.size:
+                stamp, size = record.unpack_from(head, offset)
+                offset += record.size
+                name = head[offset:offset+size]
+                if len(name) == size:
+                    return 2, name.decode('utf-8', 'replace')
+            return None
+        # Version 1 streams start with the name and a NULL.
+        try:
+            return 1, head.split(Aggregator.NULL, 1)[0].decode('utf-16')
+        except UnicodeError:
+            return None
+
+    @property
+    def position(self):
+        "Returns the file position following the last part received."
+        return self.__position
+
+    def update(self, data):
+        "Takes data from the file and buffers text messages built from it."
+        start = self.__position
+        self.__position += len(data)
+        # If something is in the buffer, add it to front of data and clear.
         if self.__buffer is not None:
-            parts.insert(0, self.__buffer)
+            start, pending = self.__buffer
+            data = pending + data
             self.__buffer = None
+        if not data:
+            return
+        # Version 1 names are UTF-16 (with a BOM), so they never start NULL.
+        if self.__version is None:
+            self.__version = 2 if data[0] == MessageWriter.MAGIC[0] else 1
+        if self.__version == 1:
+            self.__update_v1(start, data)
+        else:
+            self.__update_v2(start, data)
+
+    def __update_v1(self, start, data):
+        "Decodes (timestamp, null, text, null) parts from version 1 data."
+        parts = data.split(Aggregator.NULL)
+        # Anything following the last NULL has not been finished yet.
+        tail = parts.pop()
+        # Find the file position where each of the parts started.
+        starts = []
+        for part in parts:
+            starts.append(start)
+            start += len(part) + len(Aggregator.NULL)
+        # If there is no name, assume the first part is the name.
+        if self.__name is None and parts:
+            self.__name = parts.pop(0).decode('utf-16')
+            starts.pop(0)
         # If the parts length is odd, save tail in the buffer.
         if len(parts) & 1:
-            self.__buffer = parts.pop()
+            tail = parts.pop() + Aggregator.NULL + tail
+            start = starts.pop()
+        if tail:
+            self.__buffer = start, tail
         # Append new, waiting messages to the list.
         for index in range(0, len(parts), 2):
-            self.__waiting.append(TextMessage(self.__name, *parts[index:index+2]))
+            timestamp, text = parts[index:index+2]
+            self.__add(TextMessage(self.__name, timestamp.decode('utf-16'),
+                                   text.decode('utf-16')), starts[index])
+
+    def __update_v2(self, start, data):
+        "Decodes length-prefixed records from version 2 data."
+        offset = 0
+        if self.__name is None:
+            if len(data) < len(MessageWriter.MAGIC):
+                self.__buffer = start, data
+                return
+            if not data.startswith(MessageWriter.MAGIC):
+                raise IOError('Stream format is not recognized!')
+            offset = len(MessageWriter.MAGIC)
+        record = MessageWriter.RECORD
+        while len(data) - offset >= record.size:
+            stamp, size = record.unpack_from(data, offset)
+            end = offset + record.size + size
+            if end > len(data):
+                break
+            text = data[offset+record.size:end].decode('utf-8', 'replace')
+            # The first record is the name and the rest are messages.
+            if self.__name is None:
+                self.__name = text
+            else:
+                time = MessageWriter.EPOCH + \
+                       datetime.timedelta(microseconds=stamp)
+                self.__add(TextMessage(self.__name, time, text), start + offset)
+            offset = end
+        # Save any unfinished record (or the header) in the buffer.
+        if self.__name is None:
+            self.__buffer = start, data
+        elif offset < len(data):
+            self.__buffer = start + offset, data[offset:]
+
+    def __add(self, message, start):
+        "Queues the message and remembers where in the file it started."
+        self.__waiting.append(message)
+        self.__marks.append((message.time, start))
 
     def get_messages(self):
         "Returns the messages and clears the list."
@@ -1966,6 +2442,21 @@ class MessageStream:
         self.__waiting = []
         return messages
 
+    def checkpoint(self, oldest):
+        "Returns (position, name, offset) to reload messages after oldest."
+        if self.__name is None:
+            return None
+        # Forget where messages that are too old started.
+        while self.__marks and self.__marks[0][0] < oldest:
+            self.__marks.popleft()
+        if self.__marks:
+            offset = self.__marks[0][1]
+        elif self.__buffer is not None:
+            offset = self.__buffer[0]
+        else:
+            offset = self.__position
+        return self.__position, self.__name, offset
+
 ################################################################################
 
 # TextMessage instances are generated when needed by the MessageStream.
@@ -1980,9 +2471,11 @@ class TextMessage:
         "Initializes a message instance with given information."
         self.name = name
         try:
-            # Try to parse the timestamp.
-            self.time = datetime.datetime.strptime(timestamp,
-                                                   '%Y-%m-%dT%H:%M:%SZ')
+            # Version 1 timestamps are strings that need to be parsed.
+            if isinstance(timestamp, str):
+                timestamp = datetime.datetime.strptime(timestamp,
+                                                       '%Y-%m-%dT%H:%M:%SZ')
+            self.time = timestamp
             self.text = text.strip()
         except ValueError:
             # The messages appear corrupt.
@@ -1993,71 +2486,248 @@ class TextMessage:
 
 ################################################################################
 
+# The running hash of a message stream can be saved and resumed with SHA512.
+
+class SHA512:
+
+    "SHA512(state=None) -> SHA512"
+
+    MASK = (1 << 64) - 1
+    # OpenSSL libraries that may be used to hash large amounts of data.
+    LIBRARIES = 'libcrypto-3-x64', 'libcrypto-3', 'libcrypto-1_1'
+
+    __slots__ = '__h', '__buffer', '__size'
+
+    def __init__(self, state=None):
+        "Initializes the hash with a saved state or the starting values."
+        if state is None:
+            state = self.IV, b'', 0
+        h, self.__buffer, self.__size = state
+        self.__h = list(h)
+
+    @property
+    def state(self):
+        "Returns a state that can be saved and given back to the class."
+        return tuple(self.__h), self.__buffer, self.__size
+
+    @property
+    def size(self):
+        "Returns the number of bytes that have been hashed so far."
+        return self.__size
+
+    @classmethod
+    def seed(cls, data):
+        "Returns a hash of the data (computed by OpenSSL when possible)."
+        hasher = cls.__native(data)
+        if hasher is None:
+            hasher = cls()
+            hasher.update(data)
+        return hasher
+
+    @classmethod
+    def __native(cls, data):
+        "Hashes data with OpenSSL and reads its state (or returns None)."
+        for name in (ctypes.util.find_library('crypto'),) + cls.LIBRARIES:
+            if name is None:
+                continue
+            try:
+                crypto = ctypes.CDLL(name)
+                # SHA512_CTX holds h[8], Nl, Nh, a 128 byte block, and num.
+                context = ctypes.create_string_buffer(216)
+                crypto.SHA512_Init(context)
+                crypto.SHA512_Update(context, data, ctypes.c_size_t(len(data)))
+            except (OSError, AttributeError):
+                continue
+            h = struct.unpack_from('=8Q', context)
+            num = struct.unpack_from('=I', context, 208)[0]
+            hasher = cls((h, context.raw[80:80+num], len(data)))
+            # Only trust the state if it gives the same hash as hashlib.
+            if hasher.hexdigest() == hashlib.sha512(data).hexdigest():
+                return hasher
+        return None
+
+    def update(self, data):
+        "Adds the data to the hash (in 128 byte blocks)."
+        self.__size += len(data)
+        data = self.__buffer + data
+        end = len(data) - len(data) % 128
+        for offset in range(0, end, 128):
+            self.__compress(self.__h, data, offset)
+        self.__buffer = data[end:]
+
+    def hexdigest(self):
+        "Returns the hash of all the data as a hexadecimal string."
+        h = list(self.__h)
+        # Pad with a one bit, zeros, and the length of the data in bits.
+        data = self.__buffer + b'\x80'
+        data += bytes(-(len(data) + 16) % 128)
+        data += (self.__size * 8).to_bytes(16, 'big')
+        for offset in range(0, len(data), 128):
+            self.__compress(h, data, offset)
+        return ''.join('{:016x}'.format(value) for value in h)
+
+    @classmethod
+    def __compress(cls, h, data, offset):
+        "Mixes a 128 byte block of data into the hash values (h)."
+        mask, k = cls.MASK, cls.K
+        w = list(struct.unpack_from('>16Q', data, offset))
+        for i in range(16, 80):
+            x, y = w[i-15], w[i-2]
+            s0 = (x >> 1 | x << 63) ^ (x >> 8 | x << 56) ^ x >> 7
+            s1 = (y >> 19 | y << 45) ^ (y >> 61 | y << 3) ^ y >> 6
+            w.append((w[i-16] + s0 + w[i-7] + s1) & mask)
+        a, b, c, d, e, f, g, j = h
+        for i in range(80):
+            s1 = (e >> 14 | e << 50) ^ (e >> 18 | e << 46) ^ (e >> 41 | e << 23)
+            t1 = j + (s1 & mask) + (e & f ^ ~e & g) + k[i] + w[i]
+            s0 = (a >> 28 | a << 36) ^ (a >> 34 | a << 30) ^ (a >> 39 | a << 25)
+            t2 = (s0 & mask) + (a & b ^ a & c ^ b & c)
+            a, b, c, d, e, f, g, j = \
+               (t1 + t2) & mask, a, b, c, (d + t1) & mask, e, f, g
+        for i, value in enumerate((a, b, c, d, e, f, g, j)):
+            h[i] = h[i] + value & mask
+
+# The constants are fractions of prime roots as defined by FIPS 180-4.
+
+def _primes(count):
+    "Private module function: returns the first count prime numbers."
+    primes = []
+    number = 2
+    while len(primes) < count:
+        if all(number % prime for prime in primes):
+            primes.append(number)
+        number += 1
+    return primes
+
+def _cube_root(number):
+    "Private module function: returns the integer cube root of number."
+    root = 1 << (number.bit_length() + 2) // 3
+    while True:
+        guess = (2 * root + number // (root * root)) // 3
+        if guess >= root:
+            return root
+        root = guess
+
+SHA512.IV = tuple(math.isqrt(prime << 128) & SHA512.MASK
+                  for prime in _primes(8))
+SHA512.K = tuple(_cube_root(prime << 192) & SHA512.MASK
+                 for prime in _primes(80))
+
+################################################################################
+
 # A MessageWriter instance is used to create signed message files on Source.
 
 class MessageWriter:
 
-    "MessageWriter(path, name) -> MessageWriter"
+    "MessageWriter(path, name, sync=False, version=1) -> MessageWriter"
 
     NULL = Aggregator.NULL
     EXT = '.stream'
+    # Version 2 streams start with MAGIC and hold (time, size, text) records.
+    MAGIC = b'\0\2\0\2\0'
+    RECORD = struct.Struct('>qI')   # microseconds since EPOCH, UTF-8 size
+    EPOCH = datetime.datetime(1970, 1, 1)
     # Used by FileMonitor instances.
     SIGNATURE_LENGTH = len(UUID.CHARS) + len(EXT) + 167
     assert SIGNATURE_LENGTH <= 256, 'Signature is too long!'
 
-    __slots__ = '__name', '__primed', '__hash', '__file', '__path'
+    __slots__ = ('__name', '__primed', '__hash', '__file',
+                 '__path', '__version', '__pending', '__sync')
 
-    def __init__(self, path, name):
+    def __init__(self, path, name, sync=False, version=1):
         "Initializes instance in preparation for posting messages to file."
         # Check the name, save it, and set a couple other variables.
-        self.__name = name.encode('utf-16')
+        self.__name = name
         self.__primed = False
-        # Keep a running hash of the file.
-        self.__hash = hashlib.sha512()
+        # Messages wait here until flushed (and are synced to disk if asked).
+        self.__pending = []
+        self.__sync = sync
+        # New files are written in the version 1 format unless asked.
+        assert version in {1, 2}, 'Stream version is not supported!'
+        self.__version = version
+        # Keep a running hash of the file that can be saved and resumed.
+        self.__hash = SHA512()
         # Find the proper file for the message stream.
         self.__file = self.__find(path)
         self.__path = os.path.join(path, self.__file)
-        # Save the filename, whatever it might be, for future use.
-        CACHE.out_msg_file = self.__file
+        # Save the filename and hash state, whatever they are, for future use.
+        self.__remember()
 
     def __find(self, path):
         "Tries to find the correct file to post messages to."
-        # Pull whatever name is available out of the cache.
-        name = CACHE.out_msg_file
+        # Pull whatever name and hash state are available out of the cache.
+        name, state = CACHE.out_msg_file, CACHE.out_msg_hash
         if name:
             full_path = os.path.join(path, name)
             if os.path.isfile(full_path):
-                # Open the file and skip the signature.
+                # Read the signature and find the name after it.
                 with open(full_path, 'rb') as file:
-                    file.seek(self.SIGNATURE_LENGTH)
-                    if file.tell() == self.SIGNATURE_LENGTH:
-                        # Find out if the name is with the first 256 bytes.
-                        data = file.read(256).split(self.NULL, 1)[0]
-                        if data == self.__name:
-                            file.seek(self.SIGNATURE_LENGTH)
-                            self.__hash.update(file.read())
-                            self.__primed = True
-                            return name
+                    signature = file.read(self.SIGNATURE_LENGTH)
+                    owner = MessageStream.identify(file.read(256))
+                    if owner is not None and owner[1] == self.__name:
+                        # Keep writing in the format the file started in.
+                        self.__version = owner[0]
+                        self.__primed = True
+                        size = file.seek(0, os.SEEK_END)
+                        # The saved hash is good if the file has not changed.
+                        if state is not None:
+                            hasher = SHA512(state)
+                            if size == self.SIGNATURE_LENGTH + hasher.size and \
+                               hasher.hexdigest().encode() in signature:
+                                self.__hash = hasher
+                                return name
+                        # Otherwise hash the file once so it can be resumed.
+                        file.seek(self.SIGNATURE_LENGTH)
+                        self.__hash = SHA512.seed(file.read())
+                        return name
         # Return a new, random name for use later on.
         return uuid() + self.EXT
 
     def write(self, text):
-        "Writes a new message to the file with a timestamp."
-        # Check the message for invalid characters and try priming the file.
-        self.prime()
-        # Save the message as (timestamp, null, text, null) in the file.
-        timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
-        message = timestamp.encode('utf-16') + self.NULL + \
-                  text.encode('utf-16') + self.NULL
-        self.__append_file(message)
+        "Queues a new message with a timestamp until the next flush."
+        utcnow = datetime.datetime.utcnow()
+        if self.__version == 1:
+            # Save the message as (timestamp, null, text, null) in the file.
+            timestamp = utcnow.strftime('%Y-%m-%dT%H:%M:%SZ')
+            message = timestamp.encode('utf-16') + self.NULL + \
+                      text.encode('utf-16') + self.NULL
+        else:
+            message = self.record(utcnow, text)
+        self.__pending.append(message)
+
+    @property
+    def pending(self):
+        "Returns the number of messages waiting to be flushed."
+        return len(self.__pending)
+
+    def flush(self):
+        "Writes all queued messages with a single signature update."
+        if self.__pending:
+            # Try priming the file before adding the messages to it.
+            self.prime()
+            self.__append_file(b''.join(self.__pending))
+            self.__pending = []
 
     def prime(self):
         "Ensures that a file exist to write a message to."
         if not self.__primed:
-            # Write name to file followed by a null.
-            self.__create_file(self.__name + self.NULL)
+            if self.__version == 1:
+                # Write name to file followed by a null.
+                self.__create_file(self.__name.encode('utf-16') + self.NULL)
+            else:
+                # Write the format marker followed by a record with the name.
+                utcnow = datetime.datetime.utcnow()
+                self.__create_file(self.MAGIC +
+                                   self.record(utcnow, self.__name))
             self.__primed = True
 
+    @classmethod
+    def record(cls, time, text):
+        "Packs the time and text into a version 2 record."
+        data = text.encode('utf-8')
+        stamp = (time - cls.EPOCH) // datetime.timedelta(microseconds=1)
+        return cls.RECORD.pack(stamp, len(data)) + data
+
     def __create_file(self, message):
         "Opens file, skips signature, writes message, and updates."
         with open(self.__path, 'wb') as file:
@@ -2081,6 +2751,17 @@ class MessageWriter:
         assert len(signature) == self.SIGNATURE_LENGTH, 'Signature is wrong!'
         file.seek(0)
         file.write(signature.encode())
+        if self.__sync:
+            file.flush()
+            os.fsync(file.fileno())
+        # Remember the hash so the file need not be read on the next start.
+        self.__remember()
+
+    def __remember(self):
+        "Saves the filename and hash state so the next start can resume."
+        CACHE.out_msg_file = self.__file
+        CACHE.out_msg_hash = self.__hash.state if self.__primed else None
+        CACHE.save_settings()
 
 ################################################################################
 
@@ -2139,22 +2820,33 @@ def import_(path):
 
 class Blinx(threading.Thread):
 
-    "Blinx(root, sweep) -> Blinx"
+    "Blinx(root, sweep, cache=None) -> Blinx"
 
     MAX_GIF_DIM = 96
+    # Files are shredded in chunks, several at a time, at a limited rate.
+    SHRED_PASSES = 1
+    SHRED_CHUNK = 1 << 20
+    SHRED_RATE = 16 << 20
+    SHRED_WORKERS = 4
 
-    def __init__(self, root, sweep):
+    def __init__(self, root, sweep, cache=None):
         "Initializes an instance of Source's cleaner thread."
         path = os.path.join(os.path.dirname(sys.argv[0]), 'sign.py')
         self.__check = import_(path)
         assert os.path.isdir(sweep), 'Area to sweep is not valid!'
         self.__root = root
         self.__sweep = sweep
+        # Files that passed before are remembered here (outside the sweep).
+        self.__cache = cache
         super().__init__(name='The Source Sweeper')
         self.daemon = False
 
     def run(self):
         "Executes this code when the cleaner gets started."
+        changed, doomed = [], []
+        # Stamps of checked in files are kept with sign.py's cache helpers.
+        if self.__cache is not None:
+            self.__check.load_cache(self.__cache)
         for root, dirs, files in os.walk(self.__sweep):
             for name in dirs:
                 if name.startswith('_'):
@@ -2162,8 +2854,30 @@ class Blinx(threading.Thread):
                     dirs.remove(name)
             for name in files:
                 path = os.path.join(root, name)
-                if not (self.is_exception(path) or self.is_checked_in(path)):
-                    self.destroy_file(root, name)
+                try:
+                    if self.is_exception(path):
+                        continue
+                    stamp = self.__check.file_stamp(path)
+                except EnvironmentError:
+                    # The file went away while the sweep was running.
+                    continue
+                # Files that have not changed need not be hashed again.
+                if not self.__check.is_cached(path, stamp):
+                    changed.append((root, name, stamp))
+        # Verify the changed files on a pool of worker threads.
+        with concurrent.futures.ThreadPoolExecutor() as pool:
+            paths = (os.path.join(root, name) for root, name, stamp in changed)
+            results = pool.map(self.__verify, paths)
+            for (root, name, stamp), okay in zip(changed, results):
+                path = os.path.join(root, name)
+                if okay:
+                    self.__check.record(path, stamp)
+                elif okay is not None:
+                    self.__check.record(path, None)
+                    doomed.append((root, name))
+        self.destroy_files(doomed)
+        if self.__cache is not None:
+            self.__check.save_cache(self.__cache)
 
     def is_exception(self, path):
         "Finds out if this is a file that we will make an exception for."
@@ -2188,30 +2902,40 @@ class Blinx(threading.Thread):
 
     def is_checked_in(self, path):
         "Uses the code in check.py to find out if files are checked in."
-        orig_stdout = sys.stdout
-        sys.stdout = io.StringIO()
+        return bool(self.__verify(path))
+
+    def __verify(self, path):
+        "Checks the signature of a file (None if it could not be read)."
+        output = io.StringIO()
         try:
-            self.__check.test_extension(path, True)
+            self.__check.test_extension(path, True, output)
             with open(path, 'r+b', 0) as file:
                 tag = self.__check.find_signature(file)
                 assert tag, 'Signature could not be found!'
-                nsp = self.__check.parse_id(tag)
-                self.__check.test_namespace(nsp, file)
+                nsp = self.__check.parse_id(tag, output)
+                self.__check.test_namespace(nsp, file, output)
         except (SystemExit, AssertionError):
             return False
+        except EnvironmentError:
+            return None
         else:
             return True
-        finally:
-            sys.stdout = orig_stdout
 
     @classmethod
     def destroy_dir(cls, directory):
         "Renders the directory with its contents unrecoverable."
         for root, dirs, files in os.walk(directory, False):
-            for name in files:
-                cls.destroy_file(root, name)
+            cls.destroy_files((root, name) for name in files)
             cls.try_delete(cls.try_rename(root))
 
+    @classmethod
+    def destroy_files(cls, paths):
+        "Destroys several (root, name) files at the same time."
+        with concurrent.futures.ThreadPoolExecutor(cls.SHRED_WORKERS) as pool:
+            for future in [pool.submit(cls.destroy_file, root, name)
+                           for root, name in paths]:
+                future.result()
+
     @classmethod
     def destroy_file(cls, root, name):
         "Tries to rename, overwrite, and delete the given file."
@@ -2231,19 +2955,39 @@ class Blinx(threading.Thread):
             return old
         return new
 
-    @staticmethod
-    def try_overwrite(filename):
+    @classmethod
+    def try_overwrite(cls, filename, passes=None):
         "Tries to overwrite a file."
+        if passes is None:
+            passes = cls.SHRED_PASSES
         try:
             size = os.path.getsize(filename)
             if size > 0:
                 with open(filename, 'r+b', 0) as file:
-                    while size > 0:
-                        size -= file.write(os.urandom(min(size, 1 << 20)))
+                    for _ in range(passes):
+                        # One random buffer is reused for the entire pass.
+                        chunk = min(size, cls.SHRED_CHUNK)
+                        block = memoryview(os.urandom(chunk))
+                        for offset in range(0, size, len(block)):
+                            data = block[:size - offset]
+                            cls.THROTTLE.wait(len(data))
+                            cls.write_at(file, data, offset)
+                        os.fsync(file.fileno())
         except EnvironmentError:
             pass
         return filename
 
+    @staticmethod
+    def write_at(file, data, offset):
+        "Writes all of the data to the file starting at the given offset."
+        while data:
+            if hasattr(os, 'pwrite'):
+                written = os.pwrite(file.fileno(), data, offset)
+            else:
+                file.seek(offset)
+                written = file.write(data)
+            data, offset = data[written:], offset + written
+
     @staticmethod
     def try_delete(file_or_dir):
         "Tries to delete a file or directory."
@@ -2258,12 +3002,42 @@ class Blinx(threading.Thread):
 
 ################################################################################
 
-# The following four functions form the basis for evaluating math expressions.
+# A Throttle limits how many bytes per second several threads may transfer.
+
+class Throttle:
+
+    "Throttle(rate) -> Throttle"
+
+    __slots__ = '__rate', '__lock', '__due'
+
+    def __init__(self, rate):
+        "Initializes a limit of rate bytes per second (zero for none)."
+        self.__rate = rate
+        self.__lock = threading.Lock()
+        self.__due = time.monotonic()
+
+    def wait(self, size):
+        "Blocks until size more bytes may be transferred."
+        if self.__rate > 0:
+            # Each caller reserves the next slot and sleeps until it starts.
+            with self.__lock:
+                now = time.monotonic()
+                start = max(self.__due, now)
+                self.__due = start + size / self.__rate
+            if start > now:
+                time.sleep(start - now)
+
+# All shredding threads share the same I/O budget.
+Blinx.THROTTLE = Throttle(Blinx.SHRED_RATE)
+
+################################################################################
+
+# The following functions form the basis for evaluating math expressions.
 
 def evaluate(source, local):
     "Executes all math operations found in the source."
     for expression in expressions(source):
-        local['_'] = tokens(expression).evaluate(local)
+        local['_'] = compiled(expression)(local)
 
 def expressions(source):
     "Separates expressions and yields each individually."
@@ -2282,15 +3056,25 @@ def tokens(string):
         return evaluator
     return Print(evaluator)
 
+@functools.lru_cache(256)
+def compiled(expression):
+    "Returns a cached function that evaluates the expression."
+    return tokens(expression).compile()
+
 def _tokens(string):
-    "Private module function: recursively builds a tree."
+    "Private module function: builds a tree in a single pass."
+    # All operators share one precedence and associate to the left.
+    parts = Operation.PATTERN.split(string)
+    tree = _operand(parts[0])
+    for index in range(1, len(parts), 2):
+        tree = Operation(tree, parts[index], _operand(parts[index + 1]))
+    return tree
+
+def _operand(string):
+    "Private module function: builds a leaf of the tree."
     expression = string.strip()
     if not expression:
         raise SyntaxError('empty expression')
-    divisions = Operation.split(expression)
-    if divisions:
-        left, symbol, right = divisions
-        return Operation(_tokens(left), symbol, _tokens(right))
     if len(expression.split()) > 1:
         raise SyntaxError(expression)
     if expression.startswith('0x'):
@@ -2306,7 +3090,7 @@ def _tokens(string):
     if expression.isdigit():
         return Constant(int(expression))
     try:
-        return float(expression)
+        return Constant(float(expression))
     except ValueError:
         if expression.isidentifier():
             return Variable(expression)
@@ -2330,6 +3114,10 @@ class Expression:
         "Calculates the value of this object."
         raise NotImplementedError()
 
+    def compile(self):
+        "Returns a function that calculates the value of this object."
+        raise NotImplementedError()
+
     def __repr__(self):
         "Returns a representation of this object."
         klass = type(self).__name__
@@ -2356,6 +3144,11 @@ class Constant(Expression):
         "Calculates the value of this object."
         return self.__value
 
+    def compile(self):
+        "Returns a function that calculates the value of this object."
+        value = self.__value
+        return lambda bindings: value
+
 class Variable(Expression):
 
     """Variable(name) -> Variable
@@ -2372,6 +3165,15 @@ class Variable(Expression):
             raise NameError(self.__name)
         return bindings[self.__name]
 
+    def compile(self):
+        "Returns a function that calculates the value of this object."
+        name = self.__name
+        def variable(bindings):
+            if name not in bindings:
+                raise NameError(name)
+            return bindings[name]
+        return variable
+
 class Operation(Expression):
 
     """Operation(left, symbol, right) -> Operation
@@ -2426,26 +3228,34 @@ class Operation(Expression):
         b = self.__right.evaluate(bindings)
         return self.OPERATORS[self.__symbol](a, b)
 
-    __operators = sorted(OPERATORS, key=len, reverse=True)
+    def compile(self):
+        "Returns a function that calculates the value of this object."
+        left, right = self.__left.compile(), self.__right
+        if self.__symbol == self.ASSIGNMENT:
+            if not isinstance(right, Variable):
+                def assign(bindings):
+                    raise TypeError(right)
+            else:
+                key = right._Variable__name
+                def assign(bindings):
+                    value = bindings[key] = left(bindings)
+                    return value
+            return assign
+        if self.__symbol not in self.OPERATORS:
+            raise SyntaxError(self.__symbol)
+        function, right = self.OPERATORS[self.__symbol], right.compile()
+        return lambda bindings: function(left(bindings), right(bindings))
+
+    # Longer symbols come first so that "**" is not read as two "*".
+    PATTERN = re.compile('({})'.format('|'.join(map(
+        re.escape, sorted(OPERATORS, key=len, reverse=True)))))
 
     @classmethod
     def split(cls, expression):
         "Splits expression on rightmost symbol."
-        tail = cls.__split(expression)
-        if tail:
-            symbol, right = tail
-            return expression[:-sum(map(len, tail))], symbol, right
-
-    @classmethod
-    def __split(cls, expression):
-        "Private class method: helps with split."
-        for symbol in cls.__operators:
-            if symbol in expression:
-                right = expression.rsplit(symbol, 1)[1]
-                tail = cls.__split(right)
-                if tail is None:
-                    return symbol, right
-                return tail
+        parts = cls.PATTERN.split(expression)
+        if len(parts) > 1:
+            return ''.join(parts[:-2]), parts[-2], parts[-1]
 
 class Print(Expression):
 
@@ -2463,6 +3273,15 @@ class Print(Expression):
         print(value)
         return value
 
+    def compile(self):
+        "Returns a function that calculates the value of this object."
+        expression = self.__expression.compile()
+        def show(bindings):
+            value = expression(bindings)
+            print(value)
+            return value
+        return show
+
 ################################################################################
 
 # The Hermeneus class is the main GUI implementation in this application.
@@ -2473,6 +3292,12 @@ class Hermeneus(Frame):
 
     DEVELOPER = 'Zero'
     MESSAGE_DIR = 'Messages'
+    # URLs and <path> markup are found in one pass (paths may not span URLs).
+    URL = re.compile(r'(?<!\S)(?:https?|ftp)://[^\s/?#]', re.IGNORECASE)
+    MARKUP = re.compile(r'(?P<url>{}\S*)|(?P<path><[^<>]*>)'.format(URL.pattern),
+                        re.IGNORECASE)
+    PATH_TTL = 30
+    PATH_CACHE = 1 << 10
 
     @classmethod
     def main(cls, root, public_path, private_path):
@@ -2484,10 +3309,21 @@ class Hermeneus(Frame):
         CACHE = Settings(pickle_path, 'internal.pickle', Settings.APP_DAT)
         # Bind an event handler for closing the program.
         def on_close():
-             SETTINGS.save_settings()
-             CACHE.save_settings()
-             root.destroy()
-             root.quit()
+             lost = view.pending
+             try:
+                 view.flush()
+             except EnvironmentError as error:
+                 # The window still closes, but say what could not be saved.
+                 text = '{} message(s) could not be written and were dropped.'
+                 Message(root, title='Error!', icon=tkinter.messagebox.ERROR,
+                         type=tkinter.messagebox.OK,
+                         message=text.format(lost) + '\n' + str(error)).show()
+             finally:
+                 CACHE.stream_offsets = view.checkpoint()
+                 SETTINGS.save_settings()
+                 CACHE.save_settings()
+                 root.destroy()
+                 root.quit()
         root.protocol('WM_DELETE_WINDOW', on_close)
         # Set the window title and minimum size for the window.
         name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
@@ -2527,11 +3363,21 @@ class Hermeneus(Frame):
         # Save username and prepare for program I/O.
         self.__username = getpass.getuser()
         log_path = os.path.join(public_path, self.MESSAGE_DIR)
-        self.__writer = MessageWriter(log_path, self.__username)
-        self.__monitor = DirectoryMonitor(log_path)
-        self.__messages = Aggregator()
+        self.__writer = MessageWriter(log_path, self.__username,
+                                      SETTINGS.write_sync,
+                                      SETTINGS.stream_version)
+        self.__messages = Aggregator(CACHE.stream_offsets,
+                                     SETTINGS.message_backfill)
+        self.__monitor = DirectoryMonitor(log_path, self.__messages.resume)
+        # Wake up as soon as files change if the system can tell us.
+        notifier = self.__monitor.notifier
+        if notifier is not None:
+            self.tk.createfilehandler(notifier, tkinter.READABLE,
+                                      self.notified)
         # Start looking for updates to the files.
-        self.after_idle(self.update)
+        self.__timer = self.after_idle(self.update)
+        self.__flushing = False
+        self.__failed = False
 
     def configure_widgets(self):
         "Generates the frames widgets and places them on the screen."
@@ -2578,6 +3424,14 @@ class Hermeneus(Frame):
         self.__first_line = True
         self.__url_id = 0
         self.__path_id = 0
+        self.__exists = {}
+        # Text is inserted in batches and old links are forgotten in order.
+        self.__segments = []
+        self.__links = collections.deque()
+
+    def checkpoint(self):
+        "Returns where each message stream should be reloaded from."
+        return self.__messages.checkpoint(SETTINGS.message_cutoff)
 
     def select_all(self, event):
         "Selects everything in the widget."
@@ -2589,17 +3443,77 @@ class Hermeneus(Frame):
         text = self.__entry.get()
         self.__entry.delete(0, tkinter.END)
         self.__writer.write(text)
+        if SETTINGS.write_delay <= 0:
+            # Show the message now instead of waiting for the next update.
+            self.after_cancel(self.__timer)
+            self.update(True)
+        elif not self.__flushing:
+            # Messages sent within the delay are written to the file at once.
+            self.__flushing = True
+            self.after_cancel(self.__timer)
+            self.__timer = self.after(SETTINGS.write_delay, self.update, True)
 
-    def update(self):
+    @property
+    def pending(self):
+        "Returns the number of messages that have not been written yet."
+        return self.__writer.pending
+
+    def flush(self):
+        "Writes any messages that are still waiting to the file."
+        self.__flushing = False
+        self.__writer.flush()
+
+    def update(self, force=False):
         "Updates the directory monitor and displays new messages."
-        self.after(1000, self.update)
-        self.__monitor.update(self.__messages.update)
+        try:
+            self.flush()
+        except EnvironmentError as error:
+            # Unwritten messages are kept and tried again on the next update.
+            if not self.__failed:
+                self.report('Messages could not be written: {}'.format(error))
+            self.__failed = True
+        else:
+            self.__failed = False
+        try:
+            self.__monitor.update(self.__messages.update, force)
+        finally:
+            # The monitor decides how long to wait based on activity.
+            self.__timer = self.after(self.__monitor.interval, self.update)
+        self.show_messages()
+
+    def notified(self, file, mask):
+        "Updates the files that changed according to the notifier."
+        self.__monitor.changes(self.__messages.update)
+        self.show_messages()
+
+    def show_messages(self):
+        "Displays the messages waiting in the aggregator."
         # For each message, show those less than a day old.
         utcnow = datetime.datetime.utcnow()
         for message in self.__messages.get_messages():
             hours = (utcnow - message.time).total_seconds() / 3600
             if hours < SETTINGS.message_cutoff and self.allowed(message):
                 self.display(message)
+        self.render()
+
+    def render(self):
+        "Inserts all of the queued text at once and scrolls to the bottom."
+        if self.__segments:
+            self.__text['state'] = tkinter.NORMAL
+            self.__text.insert(tkinter.END, *self.__segments)
+            self.__segments.clear()
+            self.trim(SETTINGS.message_lines)
+            self.__text.see(tkinter.END)
+            self.__text['state'] = tkinter.DISABLED
+
+    def trim(self, limit):
+        "Removes lines from the top so that no more than limit remain."
+        lines = int(self.__text.index('end-1c').split('.')[0])
+        if 0 < limit < lines:
+            self.__text.delete('1.0', '{}.0'.format(lines - limit + 1))
+            # Forget the links whose text has been removed.
+            while self.__links and not self.__text.tag_ranges(self.__links[0]):
+                self.__text.tag_delete(self.__links.popleft())
 
     def allowed(self, message):
         "Tests if the message should be displayed to the screen."
@@ -2660,8 +3574,7 @@ class Hermeneus(Frame):
 
     def display(self, message):
         "Posts the message to the screen."
-        # Enable changes and take first line into account.
-        self.__text['state'] = tkinter.NORMAL
+        # Take the first line into account.
         if self.__first_line:
             self.__first_line = False
         else:
@@ -2676,10 +3589,8 @@ class Hermeneus(Frame):
         # Show the name with the proper color (message.tag).
         self.append_text('[' + message.name + ']', message.tag)
         self.append_text(' ')
-        # Add text with formatting, scroll to botton, and disable changes.
+        # Add text with formatting (it is shown when rendered).
         self.handle_message(message)
-        self.__text.see(tkinter.END)
-        self.__text['state'] = tkinter.DISABLED
 
     def handle_message(self, message):
         "Finds out if message is a command and takes appropriate action."
@@ -2695,26 +3606,42 @@ class Hermeneus(Frame):
         raise NotImplementedError('Hermeneus cannot directly run commands.')
 
     def add_text_with_URLs(self, message):
-        "Posts messages that may have URLs in them."
-        url_list = self.find_urls(message)
-        # Split on each URL, prefix, and create URL.
-        for url in url_list:
-            head, message = message.split(url, 1)
-            self.add_text_with_PATHs(head)
-            self.create_url(url)
+        "Posts messages that may have URLs or formatted paths in them."
+        plain = ''
+        for kind, (start, end) in self.scan(message):
+            text = message[start:end]
+            path = kind == 'path' and self.find_path(text)
+            # Links are created while other text is collected together.
+            if kind == 'url' or path:
+                self.add_plain_text(plain)
+                plain = ''
+                if path:
+                    self.create_path(*path)
+                else:
+                    self.create_url(text)
+            else:
+                plain += text
         # Display whatever may be left.
-        self.add_text_with_PATHs(message)
-
-    def add_text_with_PATHs(self, message):
-        "Posts messages that may have formatted paths in them."
-        path_list = self.find_paths(message)
-        # Split on each path markup and create path links.
-        for markup, path, name in path_list:
-            head, message = message.split(markup, 1)
-            self.add_plain_text(head)
-            self.create_path(path, name)
-        # Finish displaying any trailing text.
-        self.add_plain_text(message)
+        self.add_plain_text(plain)
+
+    def scan(self, message):
+        "Yields (kind, span) pairs for the text, URLs, and paths in message."
+        index = 0
+        match = self.MARKUP.search(message)
+        while match:
+            start, end = match.span()
+            if match.lastgroup == 'path' and \
+               self.URL.search(message, start + 1, end - 1):
+                # Paths may not hold URLs, so look past the opening bracket.
+                match = self.MARKUP.search(message, start + 1)
+                continue
+            if start > index:
+                yield 'text', (index, start)
+            yield match.lastgroup, (start, end)
+            index = end
+            match = self.MARKUP.search(message, end)
+        if index < len(message):
+            yield 'text', (index, len(message))
 
     def create_url(self, url):
         "Creates and shows a URL to the internal text widget."
@@ -2724,6 +3651,7 @@ class Hermeneus(Frame):
         # Insert the text and bind a command to open a webbrowser.
         self.append_text(url, 'dynamic_link', tag)
         self.__text.tag_bind(tag, '<1>', lambda event: webbrowser.open(url))
+        self.__links.append(tag)
 
     def create_path(self, path, name):
         "Creates and shows a path to the internal text widget."
@@ -2735,6 +3663,7 @@ class Hermeneus(Frame):
             # Add the text and create an opening command.
             self.append_text(name, 'dynamic_link', tag)
             self.__text.tag_bind(tag, '<1>', lambda event: os.startfile(path))
+            self.__links.append(tag)
         else:
             # Insert a link that does not do anything.
             self.append_text(name, 'static_link')
@@ -2745,58 +3674,42 @@ class Hermeneus(Frame):
             message = confuse(message)
         self.append_text(message)
 
-    def find_paths(self, message):
-        "Looks for and returns paths that may be in message."
-        # Track found paths and current search positions.
-        paths = []
-        index_a = index_b = 0
-        # While we are still searching the message's end ...
-        while index_a > -1 and index_b > -1:
-            index_a = message.find('<', index_b)
-            # If the less than symbol has been found ...
-            if index_a > -1:
-                index_b = message.find('>', index_a)
-                # If the greater than symbol has been found ...
-                if index_b > -1:
-                    path_markup = message[index_a:index_b+1]
-                    # Add path to list if it exists.
-                    self.test_and_add_path(path_markup, paths)
-        return paths
-
-    def test_and_add_path(self, markup, paths):
-        "Tests in path is valid and adds to list if so."
+    def find_path(self, markup):
+        "Returns the path and name for the markup if the path is valid."
         # Extract the path and create an "absolute" path.
         pulled = markup[1:-1].strip()
         program = os.path.dirname(sys.argv[0])
         absolute = os.path.join(program, pulled)
         # Turn the path into a normal path and test for existence.
         normal = os.path.normpath(absolute)
-        if os.path.exists(normal):
-            # Record the markup, normal path, and filename.
+        if self.path_exists(normal):
+            # Return the normal path and filename.
             base = os.path.basename(normal)
-            file = os.path.splitext(base)[0]
-            paths.append((markup, normal, file))
-
-    def find_urls(self, message):
-        "Looks for and returns URLs that may be in message."
-        urls = []
-        # Split text on whitespace.
-        for text in message.split():
-            result = urllib.parse.urlparse(text)
-            # It is a URL if the protocol is correct and there is a location.
-            if result.scheme in {'http', 'https', 'ftp'} and result.netloc:
-                urls.append(text)
-        # Return the list of found URLs.
-        return urls
+            return normal, os.path.splitext(base)[0]
+
+    def path_exists(self, path):
+        "Checks if the path exists, remembering the answer for a while."
+        now = time.monotonic()
+        cached = self.__exists.get(path)
+        if cached is None or cached[0] < now:
+            if len(self.__exists) >= self.PATH_CACHE:
+                self.__exists.clear()
+            cached = self.__exists[path] = now + self.PATH_TTL, \
+                     os.path.exists(path)
+        return cached[1]
+
+    def report(self, text):
+        "Shows an error from the program on its own line."
+        if self.__first_line:
+            self.__first_line = False
+        else:
+            self.append_text('\n')
+        self.append_text('(error)', 'command')
+        self.append_text(' ' + text)
 
     def append_text(self, string, *tag):
-        "Adds message to bottom of text widget with the given tags."
-        if not tag:
-            self.__text.insert(tkinter.END, string)
-        elif len(tag) == 1:
-            self.__text.insert(tkinter.END, string, tag[0])
-        else:
-            self.__text.insert(tkinter.END, string, tag)
+        "Queues message for bottom of text widget with the given tags."
+        self.__segments.extend((string, tag))
 
 ################################################################################
 
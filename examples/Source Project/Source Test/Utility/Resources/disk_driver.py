@@ -1,13 +1,20 @@
 # These are a bunch of modules for this code.
 import math
 import os
+import errno
 import uuid
 import pickle
 import pickletools
 import hashlib
 import bz2
 import zlib
+import lzma
+import collections
+import struct
+import time
 import _thread
+import mmap
+import concurrent.futures
 
 ################################################################################
 
@@ -41,6 +48,9 @@ class Driver:
         assert isinstance(index, int) and 0 <= index < self.__maximum, \
                'Index should be an integer in the maximum range!'
 
+    def flush(self):
+        "Makes written blocks durable; nothing to do by default."
+
     @property
     def maximum(self):
         "Returns a read-only maximum value of the driver."
@@ -112,28 +122,153 @@ class RAMDriver(Driver):
 
 ################################################################################
 
+class MMapDriver(Driver):
+
+    "MMapDriver(path, minimum) -> MMapDriver"
+
+    def __init__(self, path, minimum):
+        "Initializes driver with blocks kept in a memory-mapped sparse file."
+        maximum = math.ceil(minimum / RAMDriver.DEFAULT_QUANTUM)
+        super().__init__(maximum, RAMDriver.DEFAULT_QUANTUM)
+        self.__default = bytes(self.quantum)
+        self.__file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(self.__file.fileno()).st_size < self.total_space:
+            self.__file.truncate(self.total_space)
+        self.__map = mmap.mmap(self.__file.fileno(), self.total_space)
+        self.__view = memoryview(self.__map)
+        self.__used = self.__find_used()
+
+    def __find_used(self):
+        "Marks the blocks of an existing file that contain any data."
+        used = bytearray(self.maximum)
+        quantum = self.quantum
+        for start, end in self.__extents():
+            for index in range(start // quantum, math.ceil(end / quantum)):
+                offset = index * quantum
+                if self.__view[offset:offset+quantum] != self.__default:
+                    used[index] = 1
+        return used
+
+    def __extents(self):
+        "Yields the ranges of the file that are not holes."
+        total = self.total_space
+        if not hasattr(os, 'SEEK_DATA'):
+            yield 0, total
+            return
+        descriptor, offset = self.__file.fileno(), 0
+        while offset < total:
+            try:
+                offset = os.lseek(descriptor, offset, os.SEEK_DATA)
+                end = os.lseek(descriptor, offset, os.SEEK_HOLE)
+            except OSError as error:
+                if error.errno != errno.ENXIO:
+                    yield offset, total
+                return
+            yield offset, min(end, total)
+            offset = end
+
+    def read(self, index):
+        "Gets the contents of the block located at the index."
+        super().read(index)
+        offset = index * self.quantum
+        return bytes(self.__view[offset:offset+self.quantum])
+
+    def write(self, index, data):
+        "Sets the contents of the block located at the index."
+        super().write(index, data)
+        offset = index * self.quantum
+        self.__view[offset:offset+self.quantum] = data
+        self.__used[index] = 1
+
+    def delete(self, index):
+        "Annihilates the block contents located at the index."
+        super().delete(index)
+        offset = index * self.quantum
+        self.__view[offset:offset+self.quantum] = self.__default
+        self.__used[index] = 0
+
+    def flush(self):
+        "Writes the changed pages of the map back to the file."
+        self.__map.flush()
+
+    def save(self, proxy):
+        "Flushes the map and uses proxy to export the used blocks."
+        self.__map.flush()
+        proxy._DiskProxy__save({index: self.read(index) for index, used
+                                in enumerate(self.__used) if used})
+
+    def close(self):
+        "Flushes the map and closes the file."
+        self.__map.flush()
+        self.__view.release()
+        self.__map.close()
+        self.__file.close()
+
+    @property
+    def used_space(self):
+        "Caculates amount of space in use and returns value."
+        return self.__used.count(1) * self.quantum
+
+    @property
+    def free_space(self):
+        "Caculates amount of unoccupied space and returns value."
+        return (self.maximum - self.__used.count(1)) * self.quantum
+
+################################################################################
+
 class DiskProxy:
 
-    "DiskProxy(path, target) -> DiskProxy"
+    "DiskProxy(path, target, workers=None) -> DiskProxy"
+
+    INDEX = b'DPINDEX1'     # Marks the index footer of an archive.
+    ENTRY = 32              # Room to reserve for each entry in the index.
+    BATCH = 256             # Blocks given to a worker to compress at once.
 
-    def __init__(self, path, target):
+    def __init__(self, path, target, workers=None):
         "Initializes proxy with the repository's settings."
         assert isinstance(target, int) and target > 0, 'Bad target file size!'
         self.__path = path
         self.__target = target
+        self.__workers = workers or os.cpu_count() or 1
 
     def __save(self, blocks):
         "Used by RAMDriver to export internal blocks to disk."
         assert not os.path.exists(self.__path), 'Target path already exists!'
         os.makedirs(self.__path)
         if blocks:
-            file = self.__new_file()
-            for key, value in blocks.items():
-                if sum(value):
-                    if file.tell() >= self.__target:
-                        file = self.__new_file()
-                    block = key, SmartBlock(value)
-                    file.write(pickletools.optimize(pickle.dumps(block)))
+            file, index = self.__new_file(), {}
+            for key, record in self.__compress(blocks):
+                if file.tell() >= self.__target or \
+                   self.__is_full(file, index, record):
+                    self.__finish(file, index)
+                    file, index = self.__new_file(), {}
+                index[key] = file.tell(), len(record)
+                file.write(record)
+            self.__finish(file, index)
+
+    def __compress(self, blocks):
+        "Yields the records of non-zero blocks in order as workers make them."
+        batches, batch = [], []
+        for key, value in blocks.items():
+            if sum(value):
+                batch.append((key, value))
+                if len(batch) == self.BATCH:
+                    batches.append(batch)
+                    batch = []
+        if batch:
+            batches.append(batch)
+        if self.__workers == 1 or len(batches) < 2:
+            for batch in batches:
+                yield from SmartBlock.pack(batch)
+            return
+        with concurrent.futures.ProcessPoolExecutor(self.__workers) as pool:
+            pending = collections.deque()
+            for batch in batches:
+                pending.append(pool.submit(SmartBlock.pack, batch))
+                if len(pending) > self.__workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
 
     def __new_file(self):
         "Creates a new block archive to be automatically signed."
@@ -141,27 +276,352 @@ class DiskProxy:
         path = os.path.join(self.__path, name)
         return SignedWriter(path)
 
+    def __is_full(self, file, index, record):
+        "Checks if the record and a larger index would not fit in the file."
+        size = file.tell() + len(record) + self.ENTRY * (len(index) + 1)
+        return size + len(self.INDEX) + 8 > SignedWriter.MAX_SIZE
+
+    def __finish(self, file, index):
+        "Writes the index footer to an archive and closes the file."
+        offset = file.tell()
+        file.write(pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+        file.write(self.INDEX + offset.to_bytes(8, 'big'))
+        file.close()
+
     def load(self, driver):
         "Opens repository files and extracts the data from them."
         assert os.path.isdir(self.__path), 'Target path is not directory!'
+        with concurrent.futures.ThreadPoolExecutor(self.__workers) as pool:
+            for blocks in pool.map(self.__get_data, self.__archives()):
+                for key, value in blocks:
+                    driver.write(key, value)
+
+    def locate(self):
+        "Maps the archived blocks to their (path, offset, length) records."
+        assert os.path.isdir(self.__path), 'Target path is not directory!'
+        records = {}
+        for path in self.__archives():
+            with open(path, 'rb') as file:
+                for key, offset, length in self.__get_index(file):
+                    records[key] = path, offset, length
+        return records
+
+    def __archives(self):
+        "Lists the paths of all block archives in the repository."
+        paths = []
         for name in os.listdir(self.__path):
             if os.path.splitext(name)[1].lower() == '.bin':
                 path = os.path.join(self.__path, name)
                 if os.path.isfile(path):
-                    with open(path, 'rb') as file:
-                        self.__get_data(file, driver)
+                    paths.append(path)
+        return paths
+
+    def __get_data(self, path):
+        "Reads all records in a file and returns their keys and values."
+        blocks = []
+        with open(path, 'rb') as file:
+            for key, offset, length in self.__get_index(file):
+                file.seek(offset)
+                key, block = pickle.loads(file.read(length))
+                blocks.append((key, block.value))
+        return blocks
 
-    def __get_data(self, file, driver):
-        "Reads all records in a file and writes them to the driver."
+    def __get_index(self, file):
+        "Reads the index footer or finds the records in older archives."
+        file.seek(0, os.SEEK_END)
+        if file.tell() >= len(self.INDEX) + 8:
+            file.seek(-len(self.INDEX) - 8, os.SEEK_END)
+            footer = file.read()
+            if footer.startswith(self.INDEX):
+                file.seek(int.from_bytes(footer[len(self.INDEX):], 'big'))
+                index = pickle.load(file)
+                return [(key,) + record for key, record in index.items()]
+        file.seek(0)
         seek = file.read(1)
         if seek:
             file.seek(seek[0])
+        records = []
         try:
             while True:
+                offset = file.tell()
                 key, block = pickle.load(file)
-                driver.write(key, block.value)
+                records.append((key, offset, file.tell() - offset))
         except EOFError:
             pass
+        return records
+
+################################################################################
+
+class LazyDriver(Driver):
+
+    "LazyDriver(minimum, proxy) -> LazyDriver"
+
+    def __init__(self, minimum, proxy):
+        "Initializes driver with blocks that are read from archives as needed."
+        maximum = math.ceil(minimum / RAMDriver.DEFAULT_QUANTUM)
+        super().__init__(maximum, RAMDriver.DEFAULT_QUANTUM)
+        self.__default = bytes(self.quantum)
+        self.__storage = dict()
+        self.__records = proxy.locate()
+        self.__maps = dict()
+        self.__lock = _thread.allocate_lock()
+
+    def read(self, index):
+        "Gets the contents of the block located at the index."
+        super().read(index)
+        if index in self.__storage:
+            return self.__storage[index]
+        record = self.__records.get(index)
+        if record is None:
+            return self.__default
+        path, offset, length = record
+        key, block = pickle.loads(self.__map(path)[offset:offset+length])
+        return block.value
+
+    def write(self, index, data):
+        "Sets the contents of the block located at the index."
+        super().write(index, data)
+        self.__storage[index] = data
+        self.__records.pop(index, None)
+
+    def delete(self, index):
+        "Annihilates the block contents located at the index."
+        super().delete(index)
+        self.__storage.pop(index, None)
+        self.__records.pop(index, None)
+
+    def save(self, proxy):
+        "Uses proxy to export state data to another location."
+        blocks = {index: self.read(index) for index in self.__records}
+        blocks.update(self.__storage)
+        proxy._DiskProxy__save(blocks)
+
+    def close(self):
+        "Releases the memory maps of the archives."
+        with self.__lock:
+            for view in self.__maps.values():
+                view.close()
+            self.__maps.clear()
+
+    def __map(self, path):
+        "Returns the (cached) memory map of an archive."
+        with self.__lock:
+            if path not in self.__maps:
+                with open(path, 'rb') as file:
+                    self.__maps[path] = mmap.mmap(file.fileno(), 0,
+                                                  access=mmap.ACCESS_READ)
+            return self.__maps[path]
+
+    @property
+    def used_space(self):
+        "Caculates amount of space in use and returns value."
+        return (len(self.__storage) + len(self.__records)) * self.quantum
+
+    @property
+    def free_space(self):
+        "Caculates amount of unoccupied space and returns value."
+        return self.total_space - self.used_space
+
+################################################################################
+
+class CachedDriver(Driver):
+
+    "CachedDriver(driver, capacity, write_back=True) -> CachedDriver"
+
+    STRIPES = 64            # Locks that keep the I/O of each block in order.
+
+    def __init__(self, driver, capacity, write_back=True):
+        "Initializes a cache of the most recently used blocks of a driver."
+        assert isinstance(capacity, int) and capacity > 0, 'Bad cache size!'
+        super().__init__(driver.maximum, driver.quantum)
+        self.__driver = driver
+        self.__capacity = capacity
+        self.__write_back = write_back
+        self.__blocks = collections.OrderedDict()
+        self.__dirty = set()
+        self.__writing = dict()
+        self.__stats = collections.Counter()
+        self.__lock = _thread.allocate_lock()
+        self.__stripes = tuple(_thread.allocate_lock()
+                               for stripe in range(self.STRIPES))
+
+    def read(self, index):
+        "Gets the contents of the block from the cache or the driver."
+        super().read(index)
+        data = self.__lookup(index)
+        if data is not None:
+            return data
+        with self.__stripes[index % self.STRIPES]:
+            # Another thread may have loaded the block in the meantime.
+            data = self.__lookup(index, False)
+            if data is not None:
+                return data
+            data = self.__driver.read(index)
+            with self.__lock:
+                self.__stats['misses'] += 1
+                cached = self.__blocks.get(index, self.__writing.get(index))
+                if cached is not None:
+                    # A write arrived while the driver was being read.
+                    return cached
+                evicted = self.__store(index, data)
+        self.__write(evicted)
+        return data
+
+    def write(self, index, data):
+        "Sets the contents of the block in the cache (and maybe the driver)."
+        super().write(index, data)
+        if self.__write_back:
+            with self.__lock:
+                self.__dirty.add(index)
+                evicted = self.__store(index, data)
+            self.__write(evicted)
+        else:
+            with self.__stripes[index % self.STRIPES]:
+                self.__driver.write(index, data)
+                with self.__lock:
+                    self.__stats['writes'] += 1
+                    self.__store(index, data)
+
+    def delete(self, index):
+        "Annihilates the block contents in the cache and the driver."
+        super().delete(index)
+        with self.__stripes[index % self.STRIPES]:
+            with self.__lock:
+                self.__blocks.pop(index, None)
+                self.__dirty.discard(index)
+                self.__writing.pop(index, None)
+            self.__driver.delete(index)
+
+    def flush(self):
+        "Writes all dirty blocks back to the driver and flushes it."
+        with self.__lock:
+            blocks = [(index, self.__blocks[index])
+                      for index in sorted(self.__dirty)]
+            self.__writing.update(blocks)
+            self.__dirty.clear()
+        self.__write(blocks)
+        self.__driver.flush()
+
+    def save(self, proxy):
+        "Flushes the cache and has the driver export its state data."
+        self.flush()
+        self.__driver.save(proxy)
+
+    def __lookup(self, index, count=True):
+        "Returns the cached contents of a block or None on a miss."
+        with self.__lock:
+            if index in self.__blocks:
+                self.__blocks.move_to_end(index)
+                data = self.__blocks[index]
+            else:
+                data = self.__writing.get(index)
+            if data is not None and count:
+                self.__stats['hits'] += 1
+            return data
+
+    def __store(self, index, data):
+        "Caches a block and returns the dirty blocks that were evicted."
+        self.__blocks[index] = data
+        self.__blocks.move_to_end(index)
+        evicted = []
+        while len(self.__blocks) > self.__capacity:
+            index, data = self.__blocks.popitem(False)
+            self.__stats['evictions'] += 1
+            if index in self.__dirty:
+                # Readers find the block here until it has been written.
+                self.__dirty.remove(index)
+                self.__writing[index] = data
+                evicted.append((index, data))
+        return evicted
+
+    def __write(self, blocks):
+        "Writes blocks back to the driver unless they were replaced."
+        for index, data in blocks:
+            with self.__stripes[index % self.STRIPES]:
+                with self.__lock:
+                    if self.__writing.get(index) is not data:
+                        continue
+                self.__driver.write(index, data)
+                with self.__lock:
+                    self.__stats['writes'] += 1
+                    if self.__writing.get(index) is data:
+                        del self.__writing[index]
+
+    @property
+    def statistics(self):
+        "Returns the hit, miss, eviction, and write counts with hit ratio."
+        with self.__lock:
+            stats = dict(self.__stats)
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        stats['ratio'] = hits / (hits + misses) if hits + misses else 0.0
+        return stats
+
+    @property
+    def used_space(self):
+        "Returns the space used by the driver (as of the last write back)."
+        return self.__driver.used_space
+
+    @property
+    def free_space(self):
+        "Returns the space free in the driver (as of the last write back)."
+        return self.__driver.free_space
+
+################################################################################
+
+class LatencyDriver(Driver):
+
+    "LatencyDriver(driver, latency) -> LatencyDriver"
+
+    def __init__(self, driver, latency):
+        "Initializes a driver that delays each operation of another one."
+        assert latency >= 0, 'Latency may not be negative!'
+        super().__init__(driver.maximum, driver.quantum)
+        self.__driver = driver
+        self.__latency = latency
+        self.__stats = collections.Counter()
+
+    def read(self, index):
+        "Waits and then reads the block from the driver."
+        self.__delay('reads')
+        return self.__driver.read(index)
+
+    def write(self, index, data):
+        "Waits and then writes the block to the driver."
+        self.__delay('writes')
+        self.__driver.write(index, data)
+
+    def delete(self, index):
+        "Waits and then deletes the block from the driver."
+        self.__delay('deletes')
+        self.__driver.delete(index)
+
+    def flush(self):
+        "Flushes the wrapped driver."
+        self.__driver.flush()
+
+    def save(self, proxy):
+        "Has the wrapped driver export its state data."
+        self.__driver.save(proxy)
+
+    def __delay(self, operation):
+        "Counts an operation and sleeps to simulate a slow device."
+        self.__stats[operation] += 1
+        time.sleep(self.__latency)
+
+    @property
+    def statistics(self):
+        "Returns the number of each kind of operation performed."
+        return dict(self.__stats)
+
+    @property
+    def used_space(self):
+        "Returns the space used by the wrapped driver."
+        return self.__driver.used_space
+
+    @property
+    def free_space(self):
+        "Returns the space free in the wrapped driver."
+        return self.__driver.free_space
 
 ################################################################################
 
@@ -194,14 +654,17 @@ class SignedWriter:
         "Returns the current writing position in the file."
         return self.__file.tell()
 
-    def __del__(self):
+    def close(self):
         "Finishes writing the signature and closes the file."
-        size = self.__file.tell()
-        self.__file.seek(self.__seek)
-        self.__file.write('{:05x}" hash="{}" />'.format(size,
-                          self.__hash.hexdigest()).encode())
-        self.__file.flush()
-        self.__file.close()
+        if not self.__file.closed:
+            size = self.__file.tell()
+            self.__file.seek(self.__seek)
+            self.__file.write('{:05x}" hash="{}" />'.format(size,
+                              self.__hash.hexdigest()).encode())
+            self.__file.flush()
+            self.__file.close()
+
+    __del__ = close
 
 ################################################################################
 
@@ -215,35 +678,84 @@ def enum(names):
 
 class SmartBlock:
 
-    "SmartBlock(binary) -> SmartBlock"
+    "SmartBlock(binary, types=None) -> SmartBlock"
 
-    TYPES = enum('RAW, BZ2, ZLIB')
+    TYPES = enum('RAW, BZ2, ZLIB, LZMA')
+    ENTROPY = 7.5           # Bits per byte above which data is left raw.
+    SAMPLE = 1 << 12        # Most bytes to look at when measuring entropy.
+    PROBE = 16              # Blocks in a batch to try with every codec.
 
-    def __init__(self, binary):
+    def __init__(self, binary, types=None):
         "Initializes instance with efficiently stored data."
-        values = (binary, bz2.compress(binary, 9), zlib.compress(binary, 9))
-        sizes = tuple(map(len, values))
-        self.__value = values[sizes.index(min(sizes))]
-        self.__type = index
+        if types is None:
+            types = () if self.entropy(binary) > self.ENTROPY else self.CODECS
+        self.__value = binary
+        self.__type = self.TYPES.RAW
+        for kind in types:
+            value = self.CODECS[kind][0](binary)
+            if len(value) < len(self.__value):
+                self.__value = value
+                self.__type = kind
+
+    @classmethod
+    def entropy(cls, binary):
+        "Estimates the information density of data in bits per byte."
+        sample = binary[::len(binary) // cls.SAMPLE + 1]
+        if not sample:
+            return 0.0
+        total = len(sample)
+        return -sum(count / total * math.log2(count / total)
+                    for count in collections.Counter(sample).values())
+
+    @classmethod
+    def pack(cls, blocks):
+        "Compresses (key, value) pairs into records, learning the best codec."
+        records, wins = [], collections.Counter()
+        for key, value in blocks:
+            if cls.entropy(value) > cls.ENTROPY:
+                types = ()
+            elif sum(wins.values()) < cls.PROBE:
+                types = cls.CODECS
+            else:
+                best = wins.most_common(1)[0][0]
+                types = () if best == cls.TYPES.RAW else (best,)
+            block = cls(value, types)
+            if types is cls.CODECS:
+                wins[block.__type] += 1
+            record = pickletools.optimize(pickle.dumps((key, block)))
+            records.append((key, record))
+        return records
 
     @property
     def value(self):
         "Returns binary data in its originally given format."
-        if self.__type == self.TYPES.BZ2:
-            return bz2.decompress(self.__value)
-        if self.__type == self.TYPES.ZLIB:
-            return zlib.decompress(self.__value)
-        return self.__value
+        if self.__type == self.TYPES.RAW:
+            return self.__value
+        return self.CODECS[self.__type][1](self.__value)
+
+SmartBlock.CODECS = {
+    SmartBlock.TYPES.BZ2: (lambda data: bz2.compress(data, 9),
+                           bz2.decompress),
+    SmartBlock.TYPES.ZLIB: (lambda data: zlib.compress(data, 9),
+                            zlib.decompress),
+    SmartBlock.TYPES.LZMA: (lambda data: lzma.compress(data, lzma.FORMAT_ALONE),
+                            lzma.decompress)}
 
 ################################################################################
 
 class DiskAbstractionLayer1:
 
-    "DiskAbstractionLayer1(driver) -> DiskAbstractionLayer1"
+    "DiskAbstractionLayer1(driver, journal=None) -> DiskAbstractionLayer1"
+
+    GROUP = 1 << 12         # Blocks summarized by each entry of the free map.
+    STRIPES = 64            # Locks that guard the data held in the blocks.
+    RECORD = struct.Struct('>IB')   # Block index and new value of the BIT.
+    JOURNAL = 1 << 16       # Journal size that triggers a checkpoint.
 
-    def __init__(self, driver):
+    def __init__(self, driver, journal=None):
         "Initializes DAL1 with driver and BIT (Block Information Table)."
         self.__driver = driver
+        self.__journal = journal
         bit_size = self.__partition()
         self.__load_BIT(bit_size)
 
@@ -272,46 +784,182 @@ class DiskAbstractionLayer1:
             blocks.append(self.__driver.read(self.__maximum + index))
         self.__BIT = bytearray().join(blocks)
         self.__BIT_lock = _thread.allocate_lock()
+        self.__dirty = set()
+        self.__pending = bytearray()
+        self.__logged = 0
+        if self.__journal is not None:
+            self.__replay()
+        self.__stripes = tuple(_thread.allocate_lock()
+                               for stripe in range(self.STRIPES))
+        self.__free = [self.__BIT.count(0, offset, min(offset + self.GROUP,
+                                                       self.__maximum))
+                       for offset in range(0, self.__maximum, self.GROUP)]
+        self.__map = bytearray(map(bool, self.__free))
+        self.__rover = 0
+
+    def __replay(self):
+        "Applies BIT changes from the journal that were not checkpointed."
+        try:
+            with open(self.__journal, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+        size = len(data) - len(data) % self.RECORD.size
+        for index, value in self.RECORD.iter_unpack(data[:size]):
+            self.__BIT[index] = value
+            self.__dirty.add(index // self.__driver.quantum)
+        self.__checkpoint()
+
+    def __changed(self, index, end):
+        "Marks part of the BIT as dirty and logs it for the journal."
+        quantum = self.__driver.quantum
+        self.__dirty.update(range(index // quantum, (end - 1) // quantum + 1))
+        if self.__journal is not None:
+            for offset in range(index, end):
+                self.__pending += self.RECORD.pack(offset, self.__BIT[offset])
 
     def alloc(self, info):
         "Acquires a free block and returns its index."
         assert info, 'May not alloc with a status of zero!'
         with self.__BIT_lock:
-            index = self.__BIT.find(b'\0')
-            if index == -1:
-                raise MemoryError()
-            self.__BIT[index] = info
+            index = self.__find(1)
+            self.__take(index, (info,))
         return index
 
+    def alloc_extent(self, infos):
+        "Acquires a run of contiguous blocks and returns their indexes."
+        assert infos and all(infos), 'May not alloc with a status of zero!'
+        with self.__BIT_lock:
+            index = self.__find(len(infos))
+            self.__take(index, infos)
+        return range(index, index + len(infos))
+
+    def __find(self, count):
+        "Finds a run of free blocks, starting at the roving pointer."
+        for start, end in ((self.__rover, self.__maximum), (0, self.__rover)):
+            if count > 1:
+                end = min(end + count - 1, self.__maximum)
+                index = self.__find_run(count, start, end)
+                if index != -1:
+                    return index
+                continue
+            group = start // self.GROUP
+            while True:
+                group = self.__map.find(1, group)
+                if group == -1 or group * self.GROUP >= end:
+                    break
+                index = self.__BIT.find(0, max(start, group * self.GROUP),
+                                        min(end, (group + 1) * self.GROUP))
+                if index != -1:
+                    return index
+                group += 1
+        raise MemoryError()
+
+    def __find_run(self, count, start, end):
+        "Walks the free map for count free blocks in a row (-1 if none)."
+        run_start = run_size = 0
+        group = start // self.GROUP
+        while True:
+            found = self.__map.find(1, group)
+            if found == -1 or found * self.GROUP >= end:
+                return -1
+            if found != group:
+                run_size = 0    # Skipped groups are full and end the run.
+            group = found
+            offset = group * self.GROUP
+            low, high = max(start, offset), min(end, offset + self.GROUP)
+            if self.__free[group] == min(self.GROUP, self.__maximum - offset):
+                lead = high - low
+            else:
+                part = self.__BIT[low:high]
+                lead = len(part) - len(part.lstrip(b'\0'))
+            if run_size + lead >= count:
+                return run_start if run_size else low
+            if lead == high - low:
+                # The run goes on into the next group.
+                if not run_size:
+                    run_start = low
+                run_size += lead
+            else:
+                index = part.find(bytes(count))
+                if index != -1:
+                    return low + index
+                run_size = len(part) - len(part.rstrip(b'\0'))
+                run_start = high - run_size
+            group += 1
+
+    def __take(self, index, infos):
+        "Marks a run of blocks as used and updates the free map."
+        end = index + len(infos)
+        self.__BIT[index:end] = bytes(infos)
+        self.__changed(index, end)
+        for group in range(index // self.GROUP, (end - 1) // self.GROUP + 1):
+            offset = group * self.GROUP
+            self.__free[group] -= min(end, offset + self.GROUP) - \
+                                  max(index, offset)
+            if not self.__free[group]:
+                self.__map[group] = 0
+        self.__rover = end % self.__maximum
+
     def read(self, index):
         "Gets the data from an allocated block and returns it."
         assert index < self.__maximum, 'Index is too large!'
-        with self.__BIT_lock:
+        with self.__stripes[index % self.STRIPES]:
             assert self.__BIT[index], 'Block has not been allocated!'
             return self.__driver.read(index)
 
     def write(self, index, data):
         "Sets the data of a block if it has already been allocated."
         assert index < self.__maximum, 'Index is too large!'
-        with self.__BIT_lock:
+        with self.__stripes[index % self.STRIPES]:
             assert self.__BIT[index], 'Block has not been allocated!'
             self.__driver.write(index, data)
 
     def free(self, index):
         "Deallocates a used block and deletes the data stored in it."
         assert index < self.__maximum, 'Index is too large!'
-        with self.__BIT_lock:
+        with self.__stripes[index % self.STRIPES]:
             assert self.__BIT[index], 'Block has not been allocated!'
             self.__driver.delete(index)
-            self.__BIT[index] = 0
+            with self.__BIT_lock:
+                self.__BIT[index] = 0
+                self.__changed(index, index + 1)
+                self.__free[index // self.GROUP] += 1
+                self.__map[index // self.GROUP] = 1
 
     def flush(self):
-        "Takes the information in the BIT and writes it to the driver."
-        quantum = self.__driver.quantum
+        "Commits BIT changes to the journal or writes them to the driver."
+        with self.__BIT_lock:
+            if self.__journal is None:
+                self.__checkpoint()
+            elif self.__pending:
+                with open(self.__journal, 'ab') as file:
+                    file.write(self.__pending)
+                    file.flush()
+                    os.fsync(file.fileno())
+                self.__logged += len(self.__pending)
+                self.__pending.clear()
+                if self.__logged >= self.JOURNAL:
+                    self.__checkpoint()
+
+    def checkpoint(self):
+        "Writes all BIT changes to the driver and empties the journal."
         with self.__BIT_lock:
-            for index, offset in enumerate(range(0, len(self.__BIT), quantum)):
-                block = bytes(self.__BIT[offset:offset+quantum])
-                self.__driver.write(index + self.__maximum, block)
+            self.__checkpoint()
+
+    def __checkpoint(self):
+        "Writes the dirty blocks of the BIT and truncates the journal."
+        quantum = self.__driver.quantum
+        for index in sorted(self.__dirty):
+            offset = index * quantum
+            block = bytes(self.__BIT[offset:offset+quantum])
+            self.__driver.write(index + self.__maximum, block)
+        self.__dirty.clear()
+        self.__pending.clear()
+        self.__driver.flush()
+        if self.__journal is not None:
+            open(self.__journal, 'wb').close()
+            self.__logged = 0
 
     def __getitem__(self, key):
         "Reads the value of the BIT for a block and returns it."
@@ -325,6 +973,7 @@ class DiskAbstractionLayer1:
         with self.__BIT_lock:
             assert self.__BIT[key], 'Block has not been allocated!'
             self.__BIT[key] = value
+            self.__changed(key, key + 1)
 
     @property
     def maximum(self):
@@ -333,69 +982,11 @@ class DiskAbstractionLayer1:
 
     @property
     def BIT_lock(self):
-        "Returns BIT lock so client can protect data operations."
+        "Returns BIT lock that guards block statuses and the free map."
         return self.__BIT_lock
 
 ################################################################################
 
-class DiskAbstractionLayer2:
-
-    "DiskAbstractionLayer2(DAL1, quantum) -> DiskAbstractionLayer2"
-
-    STATUS = enum('closed, file, dir, data')    # 00, 01, 10, 11
-    RECORD = enum('root, tail, head, whole')    # 00, 01, 10, 11
-
-    ########################################################################
-
-    class __DirRecord:
-
-        def __init__(self, owner, dirs, files, meta):
-            self.__owner = owner
-            self.__dirs = dirs
-            self.__files = files
-            self.__meta = meta
-
-        def encode(self, maximum, pointer):
-            buffer = self.__encode_owner(maximum, pointer)
-            # START HERE
-
-        def __encode_owner(self):
-            size = len(self.__owner)
-            assert size < 1 << 8, 'There are too many owners!'
-            buffer = bytearray([size])
-            for block in self.__owner:
-                buffer.extend(self.__format_pointer(block, maximum, pointer))
-            return buffer
-
-        @staticmethod
-        def __format_pointer(block, maximum, pointer):
-            assert 0 <= block <= maximum, 'Block is outside valid range!'
-            buffer = bytearray(pointer)
-            index = -1
-            while block:
-                block, byte =  divmod(block, 1 << 8)
-                buffer[index] = byte
-                index -= 1
-            return buffer
-
-    ########################################################################
-
-    class __FileRecord: pass
-
-    ########################################################################
-
-    def __init__(self, DAL1, quantum):
-        self.__DAL1 = DAL1
-        self.__pointer = math.ceil(math.log(DAL1.maximum) / math.log(1 << 8))
-        self.__quantum = quantum - self.__pointer * 2
-        assert self.__quantum > 0, 'DAL1 is incompatible with DAL2 needs.'
-        if DAL1[0]:
-            # Test the root node.
-        else:
-            # Create the root node.
-
-################################################################################
-
 class DiskAbstractionLayer2:
 
     STATUS = enum('closed, dir, file, data')
@@ -437,18 +1028,26 @@ class DiskAbstractionLayer2:
         return blocks
 
     def __alloc_node_blocks(self, total, status):
+        infos = []
+        for neg, pos in enumerate(range(total), -total):
+            if total == 1:
+                record = self.RECORD.whole
+            elif pos == 0:
+                record = self.RECORD.head
+            elif neg == -1:
+                record = self.RECORD.tail
+            else:
+                record = self.RECORD.root
+            infos.append(status << 6 | record << 4)
+        try:
+            return list(self.__DAL1.alloc_extent(infos))
+        except MemoryError:
+            pass
+        # Scatter the node when there is no run that is long enough.
         blocks = []
         try:
-            for neg, pos in enumerate(range(total), -total):
-                if total == 1:
-                    record = self.RECORD.whole
-                elif pos == 0:
-                    record = self.RECORD.head
-                elif new == -1:
-                    record = self.RECORD.tail
-                else:
-                    record = self.RECORD.root
-                blocks.append(self.__DAL1.alloc(status << 6 | record << 4))
+            for info in infos:
+                blocks.append(self.__DAL1.alloc(info))
         except MemoryError:
             for block in blocks:
                 self.__DAL1.free(block)
@@ -468,7 +1067,7 @@ class DiskAbstractionLayer2:
             self.__DAL1.write(block, bytes(buffer))
 
     def __format_dir_record(self, owners, dirs, files, meta):
-        buffer = self.__format_dir_owners(owners))
+        buffer = self.__format_dir_owners(owners)
         buffer.extend(self.__format_pointer_names(dirs))
         buffer.extend(self.__format_pointer_names(files))
         buffer.extend(self.__format_meta_info(meta))
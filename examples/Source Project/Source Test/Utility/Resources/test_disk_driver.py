@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import disk_driver
+
+################################################################################
+
+class TestMMapDriver(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'blocks.img')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_save(self):
+        driver = disk_driver.MMapDriver(self.path, 1 << 16)
+        cache = disk_driver.CachedDriver(driver, 8)
+        blocks = {index: bytes([index + 1]) * cache.quantum
+                  for index in (0, 3, 17, 63)}
+        for index, data in blocks.items():
+            cache.write(index, data)
+        cache.delete(17)
+        del blocks[17]
+        target = os.path.join(self.directory, 'archive')
+        cache.save(disk_driver.DiskProxy(target, 1 << 20, 1))
+        driver.close()
+        copy = disk_driver.RAMDriver(1 << 16)
+        disk_driver.DiskProxy(target, 1 << 20, 1).load(copy)
+        for index in range(copy.maximum):
+            expected = blocks.get(index, bytes(copy.quantum))
+            self.assertEqual(copy.read(index), expected)
+
+################################################################################
+
+if __name__ == '__main__':
+    unittest.main()
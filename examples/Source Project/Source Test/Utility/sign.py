@@ -1,9 +1,16 @@
-# <source name="sign.py" size="041b0" hash="c2bb4dc336816aceea1bcdcb630f86e90336389a3447e5e37381ac3ef1cb9ecd1a333408bed8794b2fdea86cd707e6ef23546818f98df1c9ec2209e673a2ad9d" />
+# <source name="sign.py" size="06daf" hash="0fedfbce091f34626e5a9aab230ac79fa4177acc59d2cf60085a44ee9f081ccde94f2f88e5b1018eb91eb7b0bdef28cb113f97d4fed4a1fddcdc66066047bc17" />
 import argparse
 import os
 import sys
 import hashlib
 import io
+import glob
+import contextlib
+import concurrent.futures
+import mmap
+import pickle
+import shutil
+import tempfile
 
 ################################################################################
 
@@ -22,8 +29,17 @@ TAG_SUFFIX = b'/>'
 EXPECTED = [b'name', b'size', b'hash']
 NEWLINES = [b'\r\n', b'\r', b'\n']
 
-BUFFER_SIZE = 1 << 12   # Applies to hashes.
-MAX_SIZE = 1 << 20      # Applies to files.
+BUFFER_SIZE = 1 << 16   # Applies to hashes.
+MMAP_SIZE = 1 << 22     # Applies to hashes.
+MAX_SIZE = 1 << 20      # Applies to files (larger ones are streamed).
+SIZE_DIGITS = 5         # Applies to tags (version 1).
+WIDE_DIGITS = 16        # Applies to tags (version 2).
+
+# Verified files are remembered by (size, mtime_ns, inode) when enabled.
+
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.sign_cache.pickle')
+CACHE_LIMIT = 1 << 14   # Applies to entries (the oldest ones are dropped).
+CACHE = None
 
 ################################################################################
 
@@ -34,12 +50,123 @@ def main():
     parser = argparse.ArgumentParser(description='Manage all source.')
     parser.add_argument('-v', '--version', action='version',
                         version='%(prog)s (version 1.0.0)')
+    parser.add_argument('-j', '--jobs', type=positive, default=None,
+                        help='Number of processes to use in batch mode.')
+    parser.add_argument('-b', '--buffer', type=int, default=BUFFER_SIZE,
+                        help='Number of bytes to read at a time for hashes.')
+    parser.add_argument('--cache', default=CACHE_PATH,
+                        help='File that remembers verified signatures.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Verify every file without using the cache.')
     parser.add_argument('action', choices=('in', 'out', 'test'),
                         help='Procedure to be performed by program.')
-    parser.add_argument('file', type=argparse.FileType('r+b', 0),
-                        help='File to process using the procedure.')
+    parser.add_argument('file', nargs='+',
+                        help='Files, directories, or patterns to process.')
     args = parser.parse_args()
-    globals()['check_' + args.action](args.file)
+    set_buffer_size(args.buffer)
+    if not args.no_cache:
+        load_cache(args.cache)
+    try:
+        # A single file is processed directly just as it always has been.
+        if len(args.file) == 1 and os.path.isfile(args.file[0]):
+            try:
+                file = open(args.file[0], 'r+b', 0)
+            except EnvironmentError as error:
+                parser.error("can't open '{}': {}".format(args.file[0], error))
+            globals()['check_' + args.action](file)
+        else:
+            paths = find_files(args.file, args.action == 'test')
+            sys.exit(check_batch(args.action, paths, args.jobs))
+    finally:
+        if not args.no_cache:
+            save_cache(args.cache)
+
+def positive(text):
+    "Convert an argument into an integer that must be greater than zero."
+    number = int(text)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be positive: {!r}'.format(text))
+    return number
+
+################################################################################
+
+# Batches of files are processed on a pool of processes with a summary.
+
+def find_files(patterns, allow_graylist=False):
+    "Expand directories and glob patterns into a sorted list of files."
+    extensions = WHITELIST + GRAYLIST if allow_graylist else WHITELIST
+    paths = set()
+    for pattern in patterns:
+        for match in glob.glob(pattern) or [pattern]:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    for name in files:
+                        ext = os.path.splitext(name)[1][1:].lower()
+                        if ext in extensions:
+                            paths.add(os.path.join(root, name))
+            else:
+                paths.add(match)
+    return sorted(paths)
+
+def check_batch(action, paths, jobs=None):
+    "Run the action on all paths, print a report, and return the status."
+    work = [(action, path) for path in paths]
+    if jobs == 1 or len(work) < 2:
+        return report(map(check_job, work), len(work))
+    with concurrent.futures.ProcessPoolExecutor(
+        jobs, initializer=configure, initargs=(BUFFER_SIZE, CACHE)) as pool:
+        return report(pool.map(check_job, work, chunksize=16), len(work))
+
+def report(results, total):
+    "Print the failures and a summary before returning the exit status."
+    failed = 0
+    for path, status, message, stamp in results:
+        # Workers send back what they verified so it can be saved here.
+        record(path, stamp)
+        if status:
+            failed += 1
+            print('{}: {}'.format(path, message or 'Failed.'))
+    print('{} files processed: {} passed, {} failed.'.format(
+        total, total - failed, failed))
+    return 1 if failed else 0
+
+def set_buffer_size(size):
+    "Change how many bytes are read at a time while hashing files."
+    global BUFFER_SIZE
+    if size < 1:
+        print('Buffer size must be positive.')
+        sys.exit(2)
+    BUFFER_SIZE = size
+
+def configure(buffer_size, cache):
+    "Set up a worker process with the same settings as its parent."
+    global CACHE
+    set_buffer_size(buffer_size)
+    CACHE = cache
+
+def check_job(job):
+    "Run a single action on a path and report its status and output."
+    action, path = job
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            file = open(path, 'r+b', 0)
+            globals()['check_' + action](file)
+        except SystemExit as error:
+            status = error.code
+        except (AssertionError, EnvironmentError) as error:
+            print(error)
+            status = 1
+        except Exception as error:
+            # Anything else only fails this file, not the whole batch.
+            print('{}: {}'.format(type(error).__name__, error))
+            status = 1
+        else:
+            status = 0
+    stamp = None
+    if CACHE is not None and not status:
+        stamp = CACHE.get(os.path.abspath(path))
+    return path, status, output.getvalue().strip(), stamp
 
 ################################################################################
 
@@ -54,6 +181,7 @@ def check_in(file):
             globals()['check_out_' + ext](file)
         data, newline = find_newline(file)
         globals()['check_in_' + ext](file, data, newline)
+        file = reopen(file)
         assert is_checked_in(file), 'Check in operation failed!'
         print('File has been signed into the system.')
     finally:
@@ -77,12 +205,15 @@ def check_test(file):
     "Find out if the file has a proper tag within the first 256 bytes."
     try:
         ext = test_extension(file, True)
-        tag = find_signature(file)
-        if not tag:
-            print('Tag could not be found.')
-            sys.exit(4)
-        nsp = parse_id(tag)
-        test_namespace(nsp, file)
+        if not is_cached(file):
+            tag = find_signature(file)
+            if not tag:
+                print('Tag could not be found.')
+                sys.exit(4)
+            nsp = parse_id(tag)
+            forget(file)
+            test_namespace(nsp, file)
+            remember(file)
         print('File has been signed into the system.')
     finally:
         file.close()
@@ -104,27 +235,101 @@ def is_checked_in(file):
         except SystemExit:
             pass
         else:
+            remember(file)
             return True
         finally:
             sys.stdout = orig_stdout
+    forget(file)
     return False
 
 ################################################################################
 
+# Files that have not changed since they were verified need not be hashed.
+
+def load_cache(path):
+    "Enable the verification cache and load it from the given path."
+    global CACHE
+    try:
+        with open(path, 'rb') as file:
+            CACHE = pickle.load(file)
+        assert isinstance(CACHE, dict)
+    except (IOError, EOFError, pickle.UnpicklingError, AssertionError):
+        CACHE = {}
+
+def save_cache(path):
+    "Save the verification cache (replacing the old one all at once)."
+    if CACHE is not None:
+        prune_cache(CACHE_LIMIT)
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp = '{}.{}'.format(path, os.getpid())
+        with open(temp, 'wb') as file:
+            pickle.dump(CACHE, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+
+def prune_cache(limit):
+    "Drop entries for files that are gone or changed and keep the newest."
+    for path, stamp in tuple(CACHE.items()):
+        try:
+            current = file_stamp(path)
+        except EnvironmentError:
+            current = None
+        if current != stamp:
+            del CACHE[path]
+    # Entries are kept in the order they were recorded (oldest first).
+    for path in tuple(CACHE)[:max(len(CACHE) - limit, 0)]:
+        del CACHE[path]
+
+def file_stamp(file_or_path):
+    "Get the size, modification time, and inode that identify a version."
+    if isinstance(file_or_path, str):
+        stat = os.stat(file_or_path)
+    else:
+        stat = os.fstat(file_or_path.fileno())
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+def is_cached(file_or_path, stamp=None):
+    "Find out if the file was verified and has not changed since then."
+    if CACHE is None:
+        return False
+    name = file_or_path if isinstance(file_or_path, str) else file_or_path.name
+    if stamp is None:
+        stamp = file_stamp(file_or_path)
+    return CACHE.get(os.path.abspath(name)) == stamp
+
+def record(path, stamp):
+    "Store the stamp of a verified path (or forget the path for None)."
+    if CACHE is not None:
+        path = os.path.abspath(path)
+        CACHE.pop(path, None)
+        if stamp is not None:
+            CACHE[path] = stamp
+
+def remember(file):
+    "Record that this version of the file has been verified."
+    record(file.name, file_stamp(file))
+
+def forget(file):
+    "Remove any record of the file from the verification cache."
+    record(file.name, None)
+
+################################################################################
+
 # Find out if the file extension is okay and find a probably signature.
 
-def test_extension(file_or_path, allow_graylist=False):
+def test_extension(file_or_path, allow_graylist=False, output=None):
     "Test the file's extension to find out what category it is in."
     name = file_or_path if isinstance(file_or_path, str) else file_or_path.name
     ext = os.path.splitext(name)[1][1:].lower()
     if not (ext in WHITELIST or allow_graylist and ext in GRAYLIST):
-        print('"{}" files '.format(ext), end='')
+        print('"{}" files '.format(ext), end='', file=output)
         if ext in GRAYLIST:
-            print('are not yet supported.')
+            print('are not yet supported.', file=output)
         elif ext in BLACKLIST:
-            print('will never be supported.')
+            print('will never be supported.', file=output)
         else:
-            print('are not yet recognized.')
+            print('are not yet recognized.', file=output)
         sys.exit(3)
     return ext
 
@@ -144,7 +349,7 @@ def find_signature(file, prefix=TAG_PREFIX, suffix=TAG_SUFFIX):
 
 # Allow the signature/tag to be parsed and verify the attribute namespace.
 
-def parse_id(tag):
+def parse_id(tag, output=None):
     "Generate a namespace based on attributes within the source signature."
     attributes = tag[len(TAG_PREFIX):-len(TAG_SUFFIX)]
     expected = EXPECTED[:]
@@ -155,60 +360,72 @@ def parse_id(tag):
             if attributes.startswith(key):
                 break
         else:
-            print('Tag is not properly formed.')
+            print('Tag is not properly formed.', file=output)
             sys.exit(5)
         expected.remove(name)
         attributes = attributes[len(key):]
         index = attributes.find(b'"')
         if index == -1:
-            print('Tag is not properly formed.')
+            print('Tag is not properly formed.', file=output)
             sys.exit(6)
         namespace[name] = attributes[:index]
         attributes = attributes[index:]
         if not attributes.startswith(b'" '):
-            print('Tag is not properly formed.')
+            print('Tag is not properly formed.', file=output)
             sys.exit(7)
         attributes = attributes[2:]
     if attributes:
-        print('Tag is not properly formed.')
+        print('Tag is not properly formed.', file=output)
         sys.exit(8)
     return namespace
 
-def test_namespace(nsp, file):
+def test_namespace(nsp, file, output=None):
     "Test the file for correctness based on it's signature namespace."
     if nsp[b'name'] != os.path.basename(file.name).encode():
-        print('Tag filename is not correct.')
+        print('Tag filename is not correct.', file=output)
         sys.exit(9)
     if nsp[b'hash'] != get_sha512_hash(file):
-        print('Tag hashcode is not correct.')
+        print('Tag hashcode is not correct.', file=output)
         sys.exit(10)
-    if get_size(nsp) != file.tell():
-        print('Tag filesize is not correct.')
+    if get_size(nsp, output) != file.tell():
+        print('Tag filesize is not correct.', file=output)
         sys.exit(13)
 
 ################################################################################
 
 # Provide help for testing a file's signature attribute namespace.
 
-def get_sha512_hash(file):
+def get_sha512_hash(file, head=b''):
     "Caculate the SHA-512 hash of the file following its signature."
-    hasher = hashlib.sha512()
-    buffer = file.read(BUFFER_SIZE)
-    while buffer:
-        hasher.update(buffer)
-        buffer = file.read(BUFFER_SIZE)
+    hasher = hashlib.sha512(head)
+    start = file.tell()
+    end = os.fstat(file.fileno()).st_size
+    if end - start >= MMAP_SIZE:
+        # Large files are hashed straight from a memory map.
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            with memoryview(data) as view:
+                hasher.update(view[start:])
+        file.seek(0, os.SEEK_END)
+    else:
+        # Other files are read into the same buffer over and over again.
+        buffer = bytearray(BUFFER_SIZE)
+        with memoryview(buffer) as view:
+            size = file.readinto(buffer)
+            while size:
+                hasher.update(view[:size])
+                size = file.readinto(buffer)
     return hasher.hexdigest().encode()
 
-def get_size(nsp):
+def get_size(nsp, output=None):
     "Verify and parse the size contained with the attribute namespace."
     size = nsp[b'size']
-    if len(size) != 5:
-        print('Tag filesize is not properly formatted.')
+    if len(size) not in {SIZE_DIGITS, WIDE_DIGITS}:
+        print('Tag filesize is not properly formatted.', file=output)
         sys.exit(11)
     try:
         size = int(size, 16)
     except ValueError:
-        print('Tag filesize is not a base 16 number.')
+        print('Tag filesize is not a base 16 number.', file=output)
         sys.exit(12)
     else:
         return size
@@ -221,8 +438,11 @@ def find_newline(file):
     "Check the file size and try figuring out the correct newline character."
     file.seek(0, os.SEEK_END)
     if file.tell() > MAX_SIZE:
-        print('File is too large to be checked into the system.')
-        sys.exit(15)
+        # Large files are not loaded (they will be streamed instead).
+        file.seek(0)
+        newline = scan_newline(file)
+        file.seek(0)
+        return None, newline
     file.seek(0)
     data = file.read()
     file.seek(0)
@@ -231,35 +451,88 @@ def find_newline(file):
             return data, newline
     return data, NEWLINES[0]
 
+def scan_newline(file):
+    "Figure out the newline character of a file without loading all of it."
+    found, last = set(), b''
+    chunk = file.read(BUFFER_SIZE)
+    while chunk:
+        if b'\r\n' in last + chunk:
+            return b'\r\n'
+        found.update(newline for newline in NEWLINES if newline in chunk)
+        last = chunk[-1:]
+        chunk = file.read(BUFFER_SIZE)
+    for newline in NEWLINES:
+        if newline in found:
+            return newline
+    return NEWLINES[0]
+
 def check_file_in(file, data, tag_prefix, tag_suffix):
     "Caculate the size, signature with hash, the final file state."
     name = os.path.basename(file.name).encode()
+    if data is None:
+        stream_file_in(file, name, tag_prefix, tag_suffix)
+        return
     size = calculate_filesize(name, data, tag_prefix, tag_suffix)
+    if size > MAX_SIZE:
+        stream_file_in(file, name, tag_prefix, tag_suffix)
+        return
     tag = create_tag(name, size, data, tag_suffix)
     file.write(tag_prefix + tag + tag_suffix + data)
 
 def calculate_filesize(name, data, tag_prefix, tag_suffix):
-    "Figure out what the file size will be and check against maximum."
-    size = 167 + sum(map(len, (name, data, tag_prefix, tag_suffix)))
-    if size > MAX_SIZE:
-        print('File is too large to be checked into the system.')
-        sys.exit(16)
-    return size
+    "Figure out what the file size will be with a version 1 tag."
+    return 167 + sum(map(len, (name, data, tag_prefix, tag_suffix)))
 
 def create_tag(name, size, data, tag_suffix):
     "Just create the <source name= ... /> byte string for file."
-    hash_code = create_sha512_hash(tag_suffix + data)
-    file_size = '{:05x}'.format(size).encode()
+    hash_code = create_sha512_hash(tag_suffix, data)
+    return format_tag(name, size, hash_code, SIZE_DIGITS)
+
+def format_tag(name, size, hash_code, digits):
+    "Put the name, size, and hash together into a signature tag."
+    file_size = '{:0{}x}'.format(size, digits).encode()
     return b'<source name="' + name + \
            b'" size="' + file_size + \
            b'" hash="' + hash_code + b'" />'
 
-def create_sha512_hash(data):
+def stream_file_in(file, name, tag_prefix, tag_suffix):
+    "Sign a large file with a version 2 tag by way of a temporary file."
+    file.seek(0, os.SEEK_END)
+    size = file.tell() + 178 + sum(map(len, (name, tag_prefix, tag_suffix)))
+    file.seek(0)
+    hash_code = get_sha512_hash(file, tag_suffix)
+    tag = format_tag(name, size, hash_code, WIDE_DIGITS)
+    path = os.path.abspath(file.name)
+    temp = tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                       delete=False)
+    try:
+        with temp:
+            temp.write(tag_prefix + tag + tag_suffix)
+            file.seek(0)
+            shutil.copyfileobj(file, temp, BUFFER_SIZE)
+            temp.flush()
+            os.fsync(temp.fileno())
+        shutil.copymode(path, temp.name)
+        # The original must be closed before it can be replaced on Windows.
+        file.close()
+        os.replace(temp.name, path)
+    except:
+        os.remove(temp.name)
+        raise
+
+def reopen(file):
+    "Open the file again if it was closed or replaced on the disk."
+    if file.closed or os.fstat(file.fileno()).st_ino != \
+                      os.stat(file.name).st_ino:
+        file.close()
+        file = open(file.name, 'r+b', 0)
+    return file
+
+def create_sha512_hash(*chunks):
     "Caculate the SHA-512 has for the data and the tag suffix (data prefix)."
     hasher = hashlib.sha512()
-    for index in range(0, len(data), BUFFER_SIZE):
-        buffer = data[index:index+BUFFER_SIZE]
-        hasher.update(buffer)
+    for chunk in chunks:
+        hasher.update(chunk)
     return hasher.hexdigest().encode()
 
 ################################################################################
@@ -345,7 +618,11 @@ def check_in_lsp(file, data, newline):
 
 def check_in_pl(file, data, newline):
     "Guess as to the file type and generate the tag prefix accordingly."
-    tag_prefix = guess_perl_or_prolog(data.split(newline))
+    if data is None:
+        with open(file.name, 'rb') as lines:
+            tag_prefix = guess_perl_or_prolog(lines)
+    else:
+        tag_prefix = guess_perl_or_prolog(data.split(newline))
     tag_suffix = newline
     check_file_in(file, data, tag_prefix, tag_suffix)
 
@@ -365,9 +642,9 @@ def guess_perl_or_prolog(lines):
         tokens = line.split()
         if tokens:
             token = tokens[0]
-            if token.startswith('#'):
+            if token.startswith(b'#'):
                 perl_score += 1
-            elif token.startswith('%'):
+            elif token.startswith(b'%'):
                 prolog_score += 1
     if perl_score / prolog_score >= 2:
         return b'# '
@@ -400,10 +677,17 @@ def file_check_out_error(status):
 
 def check_file_out(file):
     "Read all remaining data and write to file starting at beginning."
-    data = file.read()
-    file.seek(0)
-    file.write(data)
-    file.truncate()
+    source, target = file.tell(), 0
+    chunk = file.read(BUFFER_SIZE)
+    while chunk:
+        # Data only moves toward the start, so nothing is overwritten early.
+        source += len(chunk)
+        file.seek(target)
+        file.write(chunk)
+        target = file.tell()
+        file.seek(source)
+        chunk = file.read(BUFFER_SIZE)
+    file.truncate(target)
 
 def consume_chars(file, characters, status):
     "Get some expected characters from a file and check for validity."